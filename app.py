@@ -6,15 +6,22 @@ from starlette.types import Message
 from starlette.middleware import Middleware
 from starlette_context.middleware import RawContextMiddleware
 from starlette_context.plugins import Plugin
-from starlette_context import context
-from aiohttp import ClientSession, ClientTimeout
-from shikithon import ShikimoriAPI
-from jinja2 import Environment, FileSystemLoader
 
-from views.main import index, migrate_route
+from views.main import index, migrate_route, stats_route
 from views.cards import user_card, collection_card, bingo_card
+from src.templates import jinja_env
+from src.database import engine
+from src.bingo.refresher import BINGO_REFRESH_MODE, bingo_refresher
+from src.clients import (
+    CLIENTS_PER_REQUEST,
+    get_client_session,
+    close_client_session,
+    get_shikimori_api,
+    close_shikimori_api
+)
 
-from typing import Any, Optional, Union
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional, Union
 
 
 class AiohttpSessionPlugin(Plugin):
@@ -24,15 +31,12 @@ class AiohttpSessionPlugin(Plugin):
         self, _: Union[Request, HTTPConnection]
     ) -> Optional[Any]:
         """Runs always on request."""
-        return ClientSession(
-            timeout=ClientTimeout(10),
-            trust_env=True
-        )
+        return get_client_session()
 
     async def enrich_response(self, _: Union[Response, Message]) -> None:
         """Runs always on response."""
-        session: ClientSession = context.get("aiohttp")
-        await session.close()
+        if CLIENTS_PER_REQUEST:
+            await close_client_session()
 
 
 class ShikimoriSessionPlugin(Plugin):
@@ -42,12 +46,12 @@ class ShikimoriSessionPlugin(Plugin):
         self, _: Union[Request, HTTPConnection]
     ) -> Optional[Any]:
         """Runs always on request."""
-        return await ShikimoriAPI().open()
+        return await get_shikimori_api()
 
     async def enrich_response(self, _: Union[Response, Message]) -> None:
         """Runs always on response."""
-        session: ShikimoriAPI = context.get("shikimori")
-        await session.close()
+        if CLIENTS_PER_REQUEST:
+            await close_shikimori_api()
 
 
 class JinjaPlugin(Plugin):
@@ -57,21 +61,32 @@ class JinjaPlugin(Plugin):
         self, _: Union[Request, HTTPConnection]
     ) -> Optional[Any]:
         """Runs always on request."""
-        return Environment(
-            trim_blocks=True,
-            loader=FileSystemLoader("src/cards/"),
-            auto_reload=False
-        )
+        return jinja_env
+
+
+@asynccontextmanager
+async def lifespan(_: Starlette) -> AsyncIterator[None]:
+    get_client_session()
+    await get_shikimori_api()
+    if BINGO_REFRESH_MODE == "background":
+        bingo_refresher.start()
+    yield
+    await bingo_refresher.stop()
+    await close_client_session()
+    await close_shikimori_api()
+    await engine.dispose()
 
 
 app = Starlette(
     routes=[
         Route("/", index),
         Route("/migrate", migrate_route),
+        Route("/stats", stats_route),
         Route("/user/{user_id:str}", user_card),
         Route("/collection/{collection_id:int}", collection_card),
         Route("/bingo/{user_id:int}", bingo_card)
     ],
+    lifespan=lifespan,
     middleware=[
         Middleware(
             RawContextMiddleware,
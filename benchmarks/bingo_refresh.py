@@ -0,0 +1,133 @@
+"""Concurrent views of a stale bingo card in the background refresh mode.
+
+Every view renders the stored stats while one queued job refreshes the card,
+none of them reads the history inline. Shikimori is replaced by a stub with
+a fixed delay, the card is stored in a temporary SQLite database. Run from
+the repository root:
+
+    python -m benchmarks.bingo_refresh
+"""
+import os
+import tempfile
+
+DATABASE = os.path.join(tempfile.mkdtemp(), "bingo_refresh.db")
+os.environ["POSTGRES_DATABASE"] = DATABASE
+os.environ["BINGO_REFRESH_MODE"] = "background"
+# The stub only has the REST endpoints
+os.environ["PRODUCT_LOADER"] = "rest"
+
+import time
+import asyncio
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import httpx
+from shikithon.models import AnimeInfo
+from sqlalchemy import update
+from starlette.testclient import TestClient
+
+import app
+import views.cards
+import src.bingo.refresher as refresher
+from src.database import BingoCard, engine, init_models
+
+
+UPSTREAM_DELAY = 0.5
+BG_COLORS = ["111", "222", "333", "444", "555"]
+URL = "/bingo/5?types=anime&bg_color={}"
+
+
+def anime(product_id: int) -> AnimeInfo:
+    return AnimeInfo.model_construct(
+        id=product_id, name="x", russian="x", image=None, url=f"/animes/{product_id}",
+        kind="tv", score=8.5, status="released", episodes=12, episodes_aired=12,
+        aired_on=date(2015, 1, 1), released_on=None
+    )
+
+
+history = [SimpleNamespace(id=10, description="Просмотрено", target=anime(1))]
+history_reads = []
+
+
+async def read_history(user_id, page=1, limit=100, **kwargs):
+    history_reads.append(time.perf_counter())
+    await asyncio.sleep(UPSTREAM_DELAY)
+    return history[(page - 1) * limit:page * limit]
+
+
+async def get_product(product_id):
+    return SimpleNamespace(
+        id=product_id, genres=[], studios=[1],
+        rates_statuses_stats=[SimpleNamespace(value=1), SimpleNamespace(value=1)]
+    )
+
+
+async def get_related(product_id):
+    return []
+
+
+products = SimpleNamespace(get=get_product, related=get_related)
+api = SimpleNamespace(
+    users=SimpleNamespace(history=read_history),
+    animes=products, mangas=products, ranobes=products
+)
+
+
+async def get_api():
+    return api
+
+
+async def get_posters(db, client, products):
+    return {}
+
+
+async def make_stale() -> None:
+    async with engine.begin() as conn:
+        await conn.execute(
+            update(BingoCard)
+            .values(scanned_at=datetime.now() - timedelta(hours=1))
+        )
+
+
+async def view_all():
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def view(bg_color: str) -> float:
+            started_at = time.perf_counter()
+            response = await client.get(URL.format(bg_color))
+            if response.status_code != 200:
+                raise Exception(f"{bg_color}: status {response.status_code}")
+            return time.perf_counter() - started_at
+        started_at = time.perf_counter()
+        durations = await asyncio.gather(*[view(bg_color) for bg_color in BG_COLORS])
+        return started_at, time.perf_counter(), durations
+
+
+def main() -> None:
+    app.ShikimoriSessionPlugin.process_request = lambda self, request: get_api()
+    refresher.get_shikimori_api = get_api
+    views.cards.get_posters = get_posters
+
+    with TestClient(app.app) as client:
+        client.portal.call(init_models)
+        client.get("/bingo/5?types=anime")
+        client.portal.call(make_stale)
+        history.insert(0, SimpleNamespace(id=20, description="Просмотрено", target=anime(2)))
+        history_reads.clear()
+
+        # Different options, so every view misses the SVG cache
+        started_at, finished_at, durations = client.portal.call(view_all)
+        time.sleep(UPSTREAM_DELAY * 3)
+
+    inline_reads = len([t for t in history_reads if started_at <= t <= finished_at])
+    print(f"{len(BG_COLORS)} concurrent stale views, upstream delay {UPSTREAM_DELAY} s")
+    print(f"  slowest view: {max(durations) * 1000:.1f} ms")
+    print(f"  history reads: {len(history_reads)}, during the views: {inline_reads}")
+    if inline_reads != 0 or max(durations) >= UPSTREAM_DELAY:
+        raise Exception("A view refreshed the card inline")
+    if len(history_reads) != 1:
+        raise Exception("Expected one queued refresh")
+
+
+if __name__ == "__main__":
+    main()
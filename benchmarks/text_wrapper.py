@@ -0,0 +1,82 @@
+"""Microbenchmark of measure_text and PixelTextWrapper.
+
+Compares them with the implementation before the single pass measure_text
+and the per-wrap width memo. Run from the repository root:
+
+    python -m benchmarks.text_wrapper
+"""
+import timeit
+
+from src.text_wrapper import (
+    HYPHENATOR,
+    KERN_MODS,
+    LETTER_WIDTHS,
+    PixelTextWrapper,
+    measure_text
+)
+
+
+TITLE = "Лучшие аниме про путешествия во времени и параллельные миры, которые стоит посмотреть каждому"
+FONT_SIZE = 20
+# Collection card title layout: width, font size, max lines
+LAYOUT = (360, 20, 3)
+
+
+def reference_measure_text(text: str, font_size: int = 10) -> float:
+    width = 0
+    for idx, c in enumerate(list(text)):
+        width += LETTER_WIDTHS.get(c) or LETTER_WIDTHS.get("_median")
+        if idx != len(text) - 1:
+            width += KERN_MODS.get(f"{c}{text[idx + 1]}") or 0
+    return width * font_size
+
+
+class ReferenceTextWrapper(PixelTextWrapper):
+    # Measures every chunk again, without the per-wrap memo
+    def _measure(self, text: str) -> float:
+        return reference_measure_text(text, self.font_size)
+
+
+def wrap(wrapper_class, text: str, width: int, font_size: int, max_lines: int):
+    # Not through wrap_text_multiline, its lru_cache would serve every run
+    return wrapper_class(
+        width=width,
+        font_size=font_size,
+        use_hyphenator=HYPHENATOR,
+        max_lines=max_lines,
+        placeholder=" ..."
+    ).wrap(text)
+
+
+def bench(name: str, old, new, number: int) -> None:
+    old_seconds = min(timeit.repeat(old, number=number, repeat=5)) / number
+    new_seconds = min(timeit.repeat(new, number=number, repeat=5)) / number
+    print(
+        f"{name}: {old_seconds * 1e6:.1f} us -> {new_seconds * 1e6:.1f} us "
+        f"(x{old_seconds / new_seconds:.1f})"
+    )
+
+
+def main() -> None:
+    if measure_text(TITLE, FONT_SIZE) != reference_measure_text(TITLE, FONT_SIZE):
+        raise Exception("measure_text differs from the reference")
+    if wrap(PixelTextWrapper, TITLE, *LAYOUT) != wrap(ReferenceTextWrapper, TITLE, *LAYOUT):
+        raise Exception("PixelTextWrapper differs from the reference")
+
+    print(f"{len(TITLE)}-char title, font size {FONT_SIZE}")
+    bench(
+        "measure_text",
+        lambda: reference_measure_text(TITLE, FONT_SIZE),
+        lambda: measure_text(TITLE, FONT_SIZE),
+        number=20000
+    )
+    bench(
+        "wrap %d/%d/%d" % LAYOUT,
+        lambda: wrap(ReferenceTextWrapper, TITLE, *LAYOUT),
+        lambda: wrap(PixelTextWrapper, TITLE, *LAYOUT),
+        number=2000
+    )
+
+
+if __name__ == "__main__":
+    main()
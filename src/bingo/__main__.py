@@ -1,14 +1,24 @@
 import numpy as np
+from shikithon import ShikimoriAPI
+from shikithon.models import History
 from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 
+import os
 from typing import Any, List, Dict, Optional
 
 from ..database import BingoCard
+from ..single_flight import single_flight
 from .checks import BINGO_TASKS
 from .type_hints import ProductType
 
 
+HISTORY_PAGE_LIMIT = 100
+# The first request is small, views without new activity need nothing more
+HISTORY_PROBE_LIMIT = int(os.environ.get("HISTORY_PROBE_LIMIT", 10))
+
+
 def generate_bingo_card(
     size: int,
     product_types: List[ProductType]
@@ -32,6 +42,77 @@ def generate_bingo_card(
     }
 
 
+@single_flight(key="{user_id}-{page}-{limit}")
+async def fetch_user_history(
+    api: ShikimoriAPI,
+    user_id: int,
+    page: int,
+    limit: int
+) -> List[History]:
+    return await api.users.history(
+        user_id=user_id,
+        page=page,
+        limit=limit
+    )
+
+
+async def read_new_history(
+    api: ShikimoriAPI,
+    user_id: int,
+    last_history_id: Optional[int],
+    probe: bool = True
+) -> List[History]:
+    """History entries newer than the last checked one, newest first.
+
+    Pages back until the last checked entry or the end of the history is
+    reached. The probe is only worth it when little new activity is
+    expected: a page of HISTORY_PAGE_LIMIT entries starts from the newest
+    entry again, so a probe that misses the cursor costs an extra request.
+    """
+    new_history = []
+    seen_ids = set()
+
+    def _read_page(history: List[History]) -> bool:
+        for h in history:
+            # Ids only grow, so a deleted last entry does not make it read
+            # the whole history
+            if last_history_id is not None and h.id <= last_history_id:
+                return True
+            if h.id not in seen_ids:
+                seen_ids.add(h.id)
+                new_history.append(h)
+        return False
+
+    if probe:
+        history = await fetch_user_history(
+            api,
+            user_id,
+            page=1,
+            limit=HISTORY_PROBE_LIMIT
+        )
+        if _read_page(history) or len(history) < HISTORY_PROBE_LIMIT:
+            return new_history
+
+    page = 1
+    while True:
+        read_count = len(new_history)
+        history = await fetch_user_history(
+            api,
+            user_id,
+            page=page,
+            limit=HISTORY_PAGE_LIMIT
+        )
+        if (
+            _read_page(history) or
+            len(history) < HISTORY_PAGE_LIMIT or
+            # A page with nothing new would be requested forever
+            len(new_history) == read_count
+        ):
+            break
+        page += 1
+    return new_history
+
+
 async def db_get_bingo_card(
     db: AsyncSession,
     user_id: int
@@ -43,16 +124,49 @@ async def db_get_bingo_card(
     )).scalars().one_or_none()
 
 
+async def db_create_bingo_card(
+    db: AsyncSession,
+    data: Dict[str, Any]
+) -> BingoCard:
+    """Inserts the card, or returns the one inserted first by a concurrent request."""
+    insert = (
+        postgresql.insert
+        if db.get_bind().dialect.name == "postgresql" else
+        sqlite.insert
+    )
+    bingo_card = (await db.execute(
+        insert(BingoCard)
+        .values(**data)
+        .on_conflict_do_nothing(index_elements=[BingoCard.user_id])
+        .returning(BingoCard)
+    )).scalars().one_or_none()
+    if bingo_card is None:
+        bingo_card = await db_get_bingo_card(db, data["user_id"])
+    return bingo_card
+
+
 async def db_update_bingo_card(
     db: AsyncSession,
-    user_id: int,
+    bingo_card: BingoCard,
     data: Dict[str, Any]
-) -> None:
-    await db.execute(
+) -> bool:
+    """Updates the card if its history cursor is still the loaded one.
+
+    Otherwise a concurrent update has won, the card is reloaded with its
+    values and False is returned.
+    """
+    result = await db.execute(
         update(BingoCard)
-        .where(BingoCard.user_id == user_id)
+        .where(
+            BingoCard.user_id == bingo_card.user_id,
+            BingoCard.last_history_id.is_not_distinct_from(bingo_card.last_history_id)
+        )
         .values(**data)
     )
+    if result.rowcount == 1:
+        return True
+    await db.refresh(bingo_card)
+    return False
 
 
 def count_completed_tasks(bingo_stats: Dict[str, Optional[str]]) -> int:
@@ -1,15 +1,49 @@
 from shikithon import ShikimoriAPI
 from shikithon.models import History
 
-from typing import Callable
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+@dataclass
+class CheckStats:
+    # Checks that request product data run by the planned checks, and how
+    # many fewer than in the declared order of the checks
+    network_checks: int = 0
+    network_checks_avoided: int = 0
+
+
+check_stats = CheckStats()
+
+# Results of the checks run by a planned check, by check id
+check_results: ContextVar[Optional[Dict[int, bool]]] = ContextVar(
+    "check_results",
+    default=None
+)
+
+
+def get_check_stats() -> Dict[str, Any]:
+    return asdict(check_stats)
 
 
 class Check:
+    # Local checks cost nothing, checks that request product data cost more
+    cost: int = 0
+
+    @property
+    def needs_network(self) -> bool:
+        return self.cost > 0
+
     async def check(self, api: ShikimoriAPI, history: History) -> bool:
         raise NotImplementedError
 
     async def __call__(self, api: ShikimoriAPI, history: History) -> bool:
-        return await self.check(api, history)
+        result = await self.check(api, history)
+        results = check_results.get()
+        if results is not None:
+            results[id(self)] = result
+        return result
 
     def __invert__(self) -> "InvertCheck":
         return InvertCheck(self)
@@ -31,6 +65,10 @@ class InvertCheck(Check):
     def __init__(self, check: Check) -> None:
         self._check = check
 
+    @property
+    def cost(self) -> int:
+        return self._check.cost
+
     async def check(self, api: ShikimoriAPI, history: History) -> bool:
         return not await self._check(api, history)
 
@@ -39,6 +77,10 @@ class AndCheck(Check):
     def __init__(self, *checks: Check) -> None:
         self._checks = list(checks)
 
+    @property
+    def cost(self) -> int:
+        return sum([check.cost for check in self._checks])
+
     async def check(self, api: ShikimoriAPI, history: History) -> bool:
         for check in self._checks:
             if not await check(api, history):
@@ -50,6 +92,10 @@ class OrCheck(Check):
     def __init__(self, *checks: Check) -> None:
         self._checks = list(checks)
 
+    @property
+    def cost(self) -> int:
+        return sum([check.cost for check in self._checks])
+
     async def check(self, api: ShikimoriAPI, history: History) -> bool:
         for check in self._checks:
             if await check(api, history):
@@ -63,3 +109,103 @@ class FuncCheck(Check):
     
     async def check(self, api: ShikimoriAPI, history: History) -> bool:
         return self._func(history)
+
+
+def _get_leaves(check: Check) -> List[Check]:
+    """Checks in the order they can run."""
+    if isinstance(check, InvertCheck):
+        return _get_leaves(check._check)
+    if isinstance(check, (AndCheck, OrCheck)):
+        return [leaf for c in check._checks for leaf in _get_leaves(c)]
+    return [check]
+
+
+async def _replay(
+    check: Check,
+    api: ShikimoriAPI,
+    history: History,
+    results: Dict[int, bool]
+) -> Tuple[Optional[bool], int]:
+    """Result of the check in its declared order and the network checks run.
+
+    The results of the network checks are taken from the planned run, the
+    result is None where one of them was skipped there, and the count stops
+    at that check.
+    """
+    if isinstance(check, InvertCheck):
+        result, network_checks = await _replay(check._check, api, history, results)
+        return (None if result is None else not result), network_checks
+    if isinstance(check, (AndCheck, OrCheck)):
+        # And stops at the first False, Or at the first True
+        decisive = isinstance(check, OrCheck)
+        network_checks = 0
+        for inner_check in check._checks:
+            result, inner_network_checks = await _replay(inner_check, api, history, results)
+            network_checks += inner_network_checks
+            if result is None or result == decisive:
+                return result, network_checks
+        return not decisive, network_checks
+    if check.needs_network:
+        return results.get(id(check)), 1
+    if id(check) in results:
+        return results[id(check)], 0
+    return await check.check(api, history), 0
+
+
+class PlannedCheck(Check):
+    """Runs the planned check, counts the network checks saved by the plan."""
+
+    def __init__(self, planned: Check, declared: Check) -> None:
+        self.planned = planned
+        self.declared = declared
+        # Otherwise the checks run as declared
+        self._reordered = (
+            [id(c) for c in _get_leaves(planned)] !=
+            [id(c) for c in _get_leaves(declared)]
+        )
+
+    @property
+    def cost(self) -> int:
+        return self.planned.cost
+
+    async def check(self, api: ShikimoriAPI, history: History) -> bool:
+        results: Dict[int, bool] = {}
+        token = check_results.set(results)
+        try:
+            result = await self.planned(api, history)
+        finally:
+            check_results.reset(token)
+
+        network_checks = len([
+            leaf for leaf in _get_leaves(self.planned)
+            if leaf.needs_network and id(leaf) in results
+        ])
+        check_stats.network_checks += network_checks
+        if self._reordered:
+            _, declared_network_checks = await _replay(self.declared, api, history, results)
+            check_stats.network_checks_avoided += declared_network_checks - network_checks
+        return result
+
+
+def _plan(check: Check) -> Check:
+    if isinstance(check, InvertCheck):
+        return InvertCheck(_plan(check._check))
+    if isinstance(check, (AndCheck, OrCheck)):
+        checks = []
+        for inner_check in check._checks:
+            inner_check = _plan(inner_check)
+            if type(inner_check) is type(check):
+                checks.extend(inner_check._checks)
+            else:
+                checks.append(inner_check)
+        return type(check)(*sorted(checks, key=lambda c: c.cost))
+    return check
+
+
+def plan_check(check: Check) -> PlannedCheck:
+    """Flattens nested And/Or checks and orders their checks by cost.
+
+    The order of checks with the same cost is kept, so local checks still
+    guard the ones that request product data in the declared order.
+    """
+    return PlannedCheck(_plan(check), check)
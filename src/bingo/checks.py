@@ -9,16 +9,20 @@ from shikithon.models import (
     Ranobe,
     Relation
 )
-from cashews import cache
 
-from dataclasses import dataclass
-from typing import List, Union
+from dataclasses import dataclass, replace
+from typing import List, Optional, Union
 
-from .base_check import Check, FuncCheck
-from .type_hints import ProductType
-
-
-cache.setup("mem://", size=100)
+from .base_check import Check, FuncCheck, plan_check
+from .type_hints import ProductType, EventKind
+from ..cache import (
+    cached,
+    product_info_cache,
+    product_graphql_cache,
+    product_related_cache
+)
+from ..single_flight import single_flight
+from .product_loader import PRODUCT_LOADER, ProductInfo, product_loader
 
 
 def get_product_type(
@@ -34,12 +38,18 @@ def get_product_type(
         raise Exception("Unknown type")
 
 
-@cache(ttl="25m", key="product_info-{product_type}-{product_id}")
+@cached(
+    product_graphql_cache if PRODUCT_LOADER == "graphql" else product_info_cache,
+    key="{product_type}-{product_id}"
+)
+@single_flight(key="{product_type}-{product_id}")
 async def get_product_info(
     api: ShikimoriAPI,
     product_type: ProductType,
     product_id: int
-) -> Union[Anime, Manga, Ranobe]:
+) -> Union[Anime, Manga, Ranobe, ProductInfo]:
+    if PRODUCT_LOADER == "graphql":
+        return await product_loader.load(api, product_type, product_id)
     if product_type == "anime":
         data = await api.animes.get(product_id)
     elif product_type == "manga":
@@ -51,7 +61,8 @@ async def get_product_info(
     return data
 
 
-@cache(ttl="25m", key="product_related-{product_type}-{product_id}")
+@cached(product_related_cache, key="{product_type}-{product_id}")
+@single_flight(key="{product_type}-{product_id}")
 async def get_product_related(
     api: ShikimoriAPI,
     product_type: ProductType,
@@ -66,19 +77,51 @@ async def get_product_related(
     return data
 
 
-WatchedAnimeCheck = FuncCheck(lambda h: (
-    (h.description == "Просмотрено" or h.description.startswith("Просмотрено и оценено")) and
-    h.target.url.startswith("/animes")
-))
+def get_event_kind(description: str) -> EventKind:
+    if description == "Просмотрено" or description.startswith("Просмотрено и оценено"):
+        return "watched"
+    elif description == "Прочитано" or description.startswith("Прочитано и оценено"):
+        return "read"
+    else:
+        return "other"
+
+
+def get_url_product_type(url: str) -> Optional[ProductType]:
+    if url.startswith("/animes"):
+        return "anime"
+    elif url.startswith("/mangas"):
+        return "manga"
+    elif url.startswith("/ranobe"):
+        return "ranobe"
+    else:
+        return None
+
+
+class EventCheck(Check):
+    def __init__(
+        self,
+        events: List[EventKind],
+        products: List[ProductType]
+    ) -> None:
+        self.events = events
+        self.products = products
+
+    async def check(self, api: ShikimoriAPI, history: History) -> bool:
+        return (
+            get_event_kind(history.description) in self.events and
+            get_url_product_type(history.target.url) in self.products
+        )
+
+
+WatchedAnimeCheck = EventCheck(["watched"], ["anime"])
 
 
-ReadMangaRanobeCheck = FuncCheck(lambda h: (
-    (h.description == "Прочитано" or h.description.startswith("Прочитано и оценено")) and
-    (h.target.url.startswith("/mangas") or h.target.url.startswith("/ranobe"))
-))
+ReadMangaRanobeCheck = EventCheck(["read"], ["manga", "ranobe"])
 
 
 class GenresCheck(Check):
+    cost = 1
+
     def __init__(self, genres: Union[str, List[str]]) -> None:
         if isinstance(genres, str):
             genres = [genres]
@@ -97,6 +140,8 @@ class GenresCheck(Check):
 
 
 class PlannedMoreCompletedCheck(Check):
+    cost = 1
+
     async def check(self, api: ShikimoriAPI, history: History) -> bool:
         if history.target is None:
             return False
@@ -106,6 +151,8 @@ class PlannedMoreCompletedCheck(Check):
 
 
 class CompletedLessNUsersCheck(Check):
+    cost = 1
+
     def __init__(self, n: int) -> None:
         self._n = n
 
@@ -118,6 +165,8 @@ class CompletedLessNUsersCheck(Check):
 
 
 class AddListLessNUsersCheck(Check):
+    cost = 1
+
     def __init__(self, n: int) -> None:
         self._n = n
 
@@ -130,6 +179,8 @@ class AddListLessNUsersCheck(Check):
 
 
 class StudiosNumMoreNCheck(Check):
+    cost = 1
+
     def __init__(self, n: int) -> None:
         self._n = n
     
@@ -144,6 +195,8 @@ class StudiosNumMoreNCheck(Check):
 
 
 class AnimeAdaptationCheck(Check):
+    cost = 1
+
     def __init__(self, kind: Union[str, List[str]]) -> None:
         if isinstance(kind, str):
             kind = [kind]
@@ -245,3 +298,9 @@ BINGO_TASKS = [
     BingoTask("Посмотри аниме с цифрой в названии.", WatchedAnimeCheck & FuncCheck(lambda h: len(list(filter(str.isdigit, h.target.russian))) > 0), 0.3, ["anime"]),
     BingoTask("Прочитай мангу / ранобэ с цифрой в названии.", ReadMangaRanobeCheck & FuncCheck(lambda h: len(list(filter(str.isdigit, h.target.russian))) > 0), 0.3, ["manga", "ranobe"]),
 ]
+
+# Local checks run before the ones that request product data
+BINGO_TASKS = [
+    replace(task, check=plan_check(task.check))
+    for task in BINGO_TASKS
+]
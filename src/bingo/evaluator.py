@@ -0,0 +1,169 @@
+from shikithon import ShikimoriAPI
+from shikithon.models import History
+
+import os
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
+
+from .base_check import Check, AndCheck, PlannedCheck
+from .checks import (
+    BINGO_TASKS,
+    BingoTask,
+    EventCheck,
+    get_product_type,
+    get_product_info,
+    get_event_kind,
+    get_url_product_type
+)
+from .product_loader import PRODUCT_LOADER
+from .type_hints import EventKind, ProductType
+
+
+PREFETCH_CONCURRENCY = int(os.environ.get("BINGO_PREFETCH_CONCURRENCY", 8))
+
+
+def _get_leading_event_check(check: Check) -> Optional[EventCheck]:
+    if isinstance(check, PlannedCheck):
+        check = check.planned
+    if isinstance(check, AndCheck) and len(check._checks) > 0:
+        check = check._checks[0]
+    if isinstance(check, EventCheck):
+        return check
+    return None
+
+
+class TaskIndex:
+    """Bingo tasks that may match a history entry by its event and product.
+
+    Only the tasks whose check starts with an EventCheck are indexed, so
+    skipping a task is the same as its check returning False right away.
+    The other tasks are candidates for every entry.
+    """
+
+    def __init__(self, tasks: List[BingoTask]) -> None:
+        other_tasks = set()
+        event_tasks: Dict[EventKind, Set[str]] = {}
+        product_tasks: Dict[Tuple[EventKind, ProductType], Set[str]] = {}
+        for n, task in enumerate(tasks, start=1):
+            event_check = _get_leading_event_check(task.check)
+            if event_check is None:
+                other_tasks.add(str(n))
+                continue
+            for event in event_check.events:
+                event_tasks.setdefault(event, set()).add(str(n))
+                for product in event_check.products:
+                    product_tasks.setdefault((event, product), set()).add(str(n))
+
+        self._other_tasks = frozenset(other_tasks)
+        self._event_tasks = {
+            event: frozenset(tasks | other_tasks)
+            for event, tasks in event_tasks.items()
+        }
+        self._product_tasks = {
+            key: frozenset(tasks | other_tasks)
+            for key, tasks in product_tasks.items()
+        }
+
+    def get_tasks(self, history: History) -> Set[str]:
+        event = get_event_kind(history.description)
+        if history.target is None:
+            # EventCheck fails on such entries, they are left to the checks
+            return self._event_tasks.get(event, self._other_tasks)
+        product = get_url_product_type(history.target.url)
+        return self._product_tasks.get((event, product), self._other_tasks)
+
+
+TASK_INDEX = TaskIndex(BINGO_TASKS)
+
+
+def get_new_history(
+    history: List[History],
+    last_history_id: Optional[int]
+) -> List[History]:
+    """History entries newer than the last checked one."""
+    for i, h in enumerate(history):
+        if h.id == last_history_id:
+            return history[:i]
+    return history
+
+
+async def prefetch_product_data(
+    api: ShikimoriAPI,
+    bingo_stats: Dict[str, Optional[str]],
+    history: List[History]
+) -> None:
+    """Caches the product data requested by the checks of the open cells.
+
+    Every open cell is checked in its own task up to its first matching
+    entry, as in the sequential loop, so no more requests are made than
+    before, they are just made concurrently.
+    """
+    semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+    failed = False
+    history_tasks = [TASK_INDEX.get_tasks(h) for h in history]
+
+    if PRODUCT_LOADER == "graphql":
+        # A few more products than the checks need, but loaded by a
+        # query per PRODUCT_BATCH_SIZE of them. Errors are raised again
+        # by the checks that need the product
+        network_tasks = {
+            k for k, v in bingo_stats.items()
+            if v is None and BINGO_TASKS[int(k) - 1].check.needs_network
+        }
+        products = {
+            (get_product_type(h.target), h.target.id): None
+            for h, tasks in zip(history, history_tasks)
+            if h.target is not None and not network_tasks.isdisjoint(tasks)
+        }
+        await asyncio.gather(*[
+            get_product_info(api, product_type, product_id)
+            for product_type, product_id in products
+        ], return_exceptions=True)
+
+    async def _check_cell(k: str) -> None:
+        nonlocal failed
+        task_check = BINGO_TASKS[int(k) - 1]
+        async with semaphore:
+            try:
+                for h, tasks in zip(history, history_tasks):
+                    if k not in tasks:
+                        continue
+                    # The error is raised again by the sequential loop, so
+                    # after the first one the other cells are not worth
+                    # requesting. Tasks are not cancelled, since the cached
+                    # requests are shared with other callers
+                    if failed or await task_check.check(api, h):
+                        break
+            except Exception:
+                failed = True
+
+    await asyncio.gather(*[
+        _check_cell(k)
+        for k, v in bingo_stats.items()
+        if v is None
+    ])
+
+
+async def evaluate_history(
+    api: ShikimoriAPI,
+    bingo_stats: Dict[str, Optional[str]],
+    history: List[History],
+    last_history_id: Optional[int]
+) -> Dict[str, Optional[str]]:
+    """Bingo stats after checking the history entries newer than the last one."""
+    history = get_new_history(history, last_history_id)
+    await prefetch_product_data(api, bingo_stats, history)
+
+    # [! Change this code only if you have checked it thoroughly
+    bingo_stats = bingo_stats.copy()
+    for h in history:
+        tasks = TASK_INDEX.get_tasks(h)
+        for k, v in bingo_stats.items():
+            if v is not None or k not in tasks:
+                continue
+            task_check = BINGO_TASKS[int(k) - 1]
+            if not await task_check.check(api, h):
+                continue
+            bingo_stats[k] = f"{get_product_type(h.target)}-{h.target.id}"
+    # !]
+    return bingo_stats
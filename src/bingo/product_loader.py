@@ -0,0 +1,265 @@
+from shikithon import ShikimoriAPI
+from shikithon.enums import RequestType
+
+import os
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from ..loop_local import LoopLocal
+from .type_hints import ProductType
+
+
+logger = logging.getLogger(__name__)
+
+# rest - a request per product
+# graphql - products requested together are loaded by one query, the ones
+# it does not return are requested one by one from the REST API
+PRODUCT_LOADER = os.environ.get("PRODUCT_LOADER", "graphql")
+# Limit of the GraphQL API
+PRODUCT_BATCH_SIZE = int(os.environ.get("PRODUCT_BATCH_SIZE", 50))
+
+# Ranobe are mangas in the GraphQL API
+PRODUCT_QUERIES: Dict[ProductType, str] = {
+    "anime": "animes",
+    "manga": "mangas",
+    "ranobe": "mangas"
+}
+# Order of rates_statuses_stats in the REST API
+RATE_STATUSES = ["planned", "completed", "watching", "dropped", "on_hold"]
+
+GRAPHQL_QUERY = """
+query($ids: String, $limit: PositiveInt) {
+  %s(ids: $ids, limit: $limit, censored: false) {
+    id
+    name
+    russian
+    genres { id name russian kind }
+    statusesStats { status count }
+    %s
+  }
+}
+"""
+
+
+@dataclass(frozen=True)
+class ProductGenre:
+    id: int
+    name: str
+    russian: str
+    kind: str
+
+
+@dataclass(frozen=True)
+class ProductRateStatus:
+    name: str
+    value: int
+
+
+@dataclass(frozen=True)
+class ProductStudio:
+    id: int
+    name: str
+
+
+@dataclass(frozen=True)
+class ProductInfo:
+    """Fields of a product used by the checks, as in the REST models."""
+    id: int
+    name: str
+    russian: str
+    genres: List[ProductGenre]
+    rates_statuses_stats: List[ProductRateStatus]
+    # Only animes have studios
+    studios: List[ProductStudio] = field(default_factory=list)
+
+
+def _build_product(data: Dict[str, Any]) -> ProductInfo:
+    statuses = {s["status"]: s["count"] for s in data["statusesStats"]}
+    return ProductInfo(
+        id=int(data["id"]),
+        name=data["name"],
+        russian=data["russian"],
+        genres=[
+            ProductGenre(
+                id=int(g["id"]),
+                name=g["name"],
+                russian=g["russian"],
+                kind=g["kind"]
+            )
+            for g in data["genres"]
+        ],
+        rates_statuses_stats=[
+            ProductRateStatus(name=s, value=statuses.get(s, 0))
+            for s in RATE_STATUSES
+        ],
+        studios=[
+            ProductStudio(id=int(s["id"]), name=s["name"])
+            for s in data.get("studios", [])
+        ]
+    )
+
+
+def _build_rest_product(data: Any) -> ProductInfo:
+    return ProductInfo(
+        id=data.id,
+        name=data.name,
+        russian=data.russian,
+        genres=[
+            ProductGenre(id=g.id, name=g.name, russian=g.russian, kind=g.kind)
+            for g in data.genres
+        ],
+        rates_statuses_stats=[
+            ProductRateStatus(name=s.name, value=s.value)
+            for s in data.rates_statuses_stats
+        ],
+        studios=[
+            ProductStudio(id=s.id, name=s.name)
+            for s in getattr(data, "studios", None) or []
+        ]
+    )
+
+
+async def _load_rest_product(
+    api: ShikimoriAPI,
+    product_type: ProductType,
+    product_id: int
+) -> ProductInfo:
+    if product_type == "anime":
+        data = await api.animes.get(product_id)
+    elif product_type == "manga":
+        data = await api.mangas.get(product_id)
+    elif product_type == "ranobe":
+        data = await api.ranobes.get(product_id)
+    if data is None:
+        raise Exception("Product data cannot be None")
+    return _build_rest_product(data)
+
+
+class ProductLoader:
+    """Collects the products requested in one event loop iteration.
+
+    They are loaded by a query per GraphQL collection and batch of
+    PRODUCT_BATCH_SIZE ids, each caller gets its own product. Products the
+    query does not return, or all of them if it fails, are requested from
+    the REST API, so a GraphQL outage costs the requests of the REST
+    loader rather than the cards.
+    """
+
+    def __init__(self) -> None:
+        # (api id, GraphQL collection) -> api, product id -> requests.
+        # Kept per event loop, as the futures and the tasks
+        self._pending: LoopLocal[Dict[
+            Tuple[int, str],
+            Tuple[ShikimoriAPI, Dict[int, List[Tuple[ProductType, "asyncio.Future[Any]"]]]]
+        ]] = LoopLocal(dict)
+        self._tasks: LoopLocal[Set["asyncio.Task[None]"]] = LoopLocal(set)
+
+    def load(
+        self,
+        api: ShikimoriAPI,
+        product_type: ProductType,
+        product_id: int
+    ) -> "asyncio.Future[ProductInfo]":
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.get()
+        if not pending:
+            loop.call_soon(self._dispatch, pending)
+        _, requests = pending.setdefault(
+            (id(api), PRODUCT_QUERIES[product_type]),
+            (api, {})
+        )
+        requests.setdefault(product_id, []).append((product_type, future))
+        return future
+
+    def _dispatch(self, pending: Dict[Tuple[int, str], Any]) -> None:
+        batches = list(pending.items())
+        pending.clear()
+        tasks = self._tasks.get()
+        for (_, query), (api, requests) in batches:
+            product_ids = list(requests)
+            for i in range(0, len(product_ids), PRODUCT_BATCH_SIZE):
+                batch = {
+                    product_id: requests[product_id]
+                    for product_id in product_ids[i:i + PRODUCT_BATCH_SIZE]
+                }
+                task = asyncio.create_task(self._load_batch(api, query, batch))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+    async def _load_batch(
+        self,
+        api: ShikimoriAPI,
+        query: str,
+        batch: Dict[int, List[Tuple[ProductType, "asyncio.Future[Any]"]]]
+    ) -> None:
+        try:
+            response = await api.request(
+                f"{api.endpoints.base_url}/graphql",
+                data={
+                    "query": GRAPHQL_QUERY % (
+                        query,
+                        "studios { id name }" if query == "animes" else ""
+                    ),
+                    "variables": {
+                        "ids": ",".join(map(str, batch)),
+                        "limit": len(batch)
+                    }
+                },
+                request_type=RequestType.POST
+            )
+            if "errors" in response:
+                raise Exception(f"GraphQL errors: {response['errors']}")
+            products = {
+                int(p["id"]): _build_product(p)
+                for p in response["data"][query]
+            }
+        except Exception:
+            logger.warning(
+                "GraphQL %s query of %s products failed",
+                query,
+                len(batch),
+                exc_info=True
+            )
+            products = {}
+
+        await asyncio.gather(*[
+            self._resolve(api, product_id, requests, products.get(product_id))
+            for product_id, requests in batch.items()
+        ])
+
+    async def _resolve(
+        self,
+        api: ShikimoriAPI,
+        product_id: int,
+        requests: List[Tuple[ProductType, "asyncio.Future[Any]"]],
+        product: Optional[ProductInfo]
+    ) -> None:
+        rest_products: Dict[ProductType, Any] = {}
+        if product is None:
+            # Mangas and ranobe are one GraphQL collection, each type asked
+            # for the id has its own REST endpoint
+            for product_type, _ in requests:
+                if product_type in rest_products:
+                    continue
+                try:
+                    rest_products[product_type] = await _load_rest_product(
+                        api,
+                        product_type,
+                        product_id
+                    )
+                except Exception as e:
+                    rest_products[product_type] = e
+        for product_type, future in requests:
+            if future.done():
+                continue
+            result = product if product is not None else rest_products[product_type]
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+product_loader = ProductLoader()
@@ -0,0 +1,226 @@
+from shikithon import ShikimoriAPI
+from sqlalchemy import select, update, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+
+from ..clients import (
+    get_client_session,
+    close_client_session,
+    get_shikimori_api,
+    close_shikimori_api
+)
+from ..database import BingoCard, engine, get_db_session, pack_bingo_stats
+from ..scheduler import Priority, priority
+from .__main__ import (
+    HISTORY_PROBE_LIMIT,
+    db_get_bingo_card,
+    db_update_bingo_card,
+    read_new_history,
+    count_completed_tasks
+)
+from .evaluator import evaluate_history
+
+
+logger = logging.getLogger(__name__)
+
+# inline - the view refreshes the card itself
+# background - the view enqueues the refresh to the in-process workers
+# worker - the view marks the card, a separate worker process refreshes it
+BINGO_REFRESH_MODE = os.environ.get(
+    "BINGO_REFRESH_MODE",
+    # Serverless functions are frozen after the response
+    "inline" if os.environ.get("VERCEL") else "background"
+)
+BINGO_REFRESH_WORKERS = int(os.environ.get("BINGO_REFRESH_WORKERS", 2))
+BINGO_STALE_SECONDS = int(os.environ.get("BINGO_STALE_SECONDS", 60))
+BINGO_WORKER_INTERVAL = float(os.environ.get("BINGO_WORKER_INTERVAL", 5))
+BINGO_WORKER_BATCH = int(os.environ.get("BINGO_WORKER_BATCH", 50))
+
+
+def is_stale(bingo_card: BingoCard) -> bool:
+    return (
+        bingo_card.scanned_at is None or
+        bingo_card.scanned_at <= datetime.now() - timedelta(seconds=BINGO_STALE_SECONDS)
+    )
+
+
+async def refresh_bingo_card(
+    db: AsyncSession,
+    api: ShikimoriAPI,
+    bingo_card: BingoCard
+) -> bool:
+    """Checks the new history entries of the card, the caller commits.
+
+    False if a concurrent refresh has updated the card first.
+    """
+    history = await read_new_history(
+        api,
+        bingo_card.user_id,
+        bingo_card.last_history_id,
+        # The probe would miss the cursor again after a busy scan
+        probe=(bingo_card.history_scanned or 0) < HISTORY_PROBE_LIMIT
+    )
+    data = {
+        "history_scanned": len(history),
+        "scanned_at": datetime.now()
+    }
+    if len(history) != 0:
+        data["stats_data"] = pack_bingo_stats(await evaluate_history(
+            api=api,
+            bingo_stats=bingo_card.stats,
+            history=history,
+            last_history_id=bingo_card.last_history_id
+        ))
+        data["last_history_id"] = history[0].id
+    return await db_update_bingo_card(db, bingo_card, data)
+
+
+async def refresh_user_bingo_card(user_id: int) -> None:
+    api = await get_shikimori_api()
+    # Requests of the views go first
+    with priority(Priority.BACKGROUND):
+        async with get_db_session() as db:
+            bingo_card = await db_get_bingo_card(db, user_id)
+            if (
+                bingo_card is None or
+                count_completed_tasks(bingo_card.stats) == len(bingo_card.stats) or
+                not is_stale(bingo_card)
+            ):
+                return
+            await refresh_bingo_card(db, api, bingo_card)
+            await db.commit()
+
+
+async def clear_refresh_request(user_id: int) -> None:
+    """Stops the worker from retrying a failed refresh.
+
+    The view requests it again once the card is stale.
+    """
+    async with get_db_session() as db:
+        await db.execute(
+            update(BingoCard)
+            .where(
+                BingoCard.user_id == user_id,
+                BingoCard.refresh_requested_at.is_not(None)
+            )
+            .values(refresh_requested_at=None)
+        )
+        await db.commit()
+
+
+class BingoRefresher:
+    """In-process queue of bingo card refreshes, one job per user."""
+
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+        self._queue: Optional["asyncio.Queue[int]"] = None
+        self._pending: Set[int] = set()
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    @property
+    def running(self) -> bool:
+        return len(self._tasks) != 0
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._work())
+            for _ in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._pending.clear()
+
+    def enqueue(self, user_id: int) -> bool:
+        """False if the workers are not running.
+
+        A user that is already pending counts as scheduled.
+        """
+        if not self.running:
+            return False
+        if user_id in self._pending:
+            return True
+        self._pending.add(user_id)
+        self._queue.put_nowait(user_id)
+        return True
+
+    async def _work(self) -> None:
+        while True:
+            user_id = await self._queue.get()
+            try:
+                await refresh_user_bingo_card(user_id)
+            except Exception:
+                logger.exception("Bingo card refresh of user %s failed", user_id)
+                try:
+                    await clear_refresh_request(user_id)
+                except Exception:
+                    logger.exception("Refresh request of user %s was not cleared", user_id)
+            finally:
+                self._pending.discard(user_id)
+
+
+bingo_refresher = BingoRefresher(BINGO_REFRESH_WORKERS)
+
+
+async def request_refresh(db: AsyncSession, user_id: int) -> bool:
+    """Schedules the refresh of the card, False if it is not possible."""
+    if BINGO_REFRESH_MODE == "background":
+        return bingo_refresher.enqueue(user_id)
+    elif BINGO_REFRESH_MODE == "worker":
+        await db.execute(
+            update(BingoCard)
+            .where(BingoCard.user_id == user_id)
+            .values(refresh_requested_at=datetime.now())
+        )
+        await db.commit()
+        return True
+    return False
+
+
+async def run_worker() -> None:
+    """Refreshes the cards marked by the views in the worker mode.
+
+    python -m src.bingo.refresher
+    """
+    get_client_session()
+    await get_shikimori_api()
+    bingo_refresher.start()
+    try:
+        while True:
+            async with get_db_session() as db:
+                user_ids = (await db.execute(
+                    select(BingoCard.user_id)
+                    .where(
+                        BingoCard.refresh_requested_at.is_not(None),
+                        or_(
+                            BingoCard.scanned_at.is_(None),
+                            BingoCard.scanned_at < BingoCard.refresh_requested_at
+                        )
+                    )
+                    .order_by(BingoCard.refresh_requested_at)
+                    .limit(BINGO_WORKER_BATCH)
+                )).scalars().all()
+            for user_id in user_ids:
+                bingo_refresher.enqueue(user_id)
+            await asyncio.sleep(BINGO_WORKER_INTERVAL)
+    finally:
+        await bingo_refresher.stop()
+        await close_client_session()
+        await close_shikimori_api()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker())
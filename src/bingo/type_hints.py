@@ -2,3 +2,4 @@ from typing import Literal
 
 
 ProductType = Literal["anime", "manga", "ranobe"]
+EventKind = Literal["watched", "read", "other"]
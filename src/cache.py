@@ -0,0 +1,234 @@
+from cashews import Cache
+
+import os
+import time
+import asyncio
+import inspect
+import logging
+from functools import wraps
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from .loop_local import LoopLocal
+from .scheduler import Priority, priority
+from .utils import CACHE_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Cache shared by the processes and instances, behind the local ones:
+# redis://host:6379/0 - Redis-compatible server (needs redis)
+# disk://?directory=/tmp/cards - SQLite file (needs diskcache)
+# mem:// - in-process stand-in for tests
+SHARED_CACHE_URL = os.environ.get("SHARED_CACHE_URL")
+
+shared_cache: Optional[Cache] = None
+if SHARED_CACHE_URL:
+    shared_cache = Cache("shared")
+    shared_cache.setup(SHARED_CACHE_URL)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    shared_hits: int = 0
+    # Served after the TTL while refreshed in the background
+    stale_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        hits = self.hits + self.shared_hits + self.stale_hits
+        total = hits + self.misses
+        return hits / total if total else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 3)
+        }
+
+
+@dataclass(frozen=True)
+class StaleEntry:
+    value: Any
+    fresh_until: float
+
+    @property
+    def is_fresh(self) -> bool:
+        return time.time() < self.fresh_until
+
+
+class NamespaceCache:
+    """In-process LRU cache, in front of the shared cache if it is enabled.
+
+    Size, TTL and use of the shared cache can be set for each namespace by
+    <NAMESPACE>_CACHE_SIZE, <NAMESPACE>_CACHE_TTL and <NAMESPACE>_CACHE_SHARED.
+    With <NAMESPACE>_CACHE_STALE_TTL the values are kept that much longer,
+    get_or_fetch serves them and refreshes them in the background.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        size: int,
+        ttl: int,
+        shared: bool = False,
+        stale_ttl: int = 0
+    ) -> None:
+        prefix = namespace.upper()
+        self.namespace = namespace
+        self.ttl = int(os.environ.get(f"{prefix}_CACHE_TTL", ttl))
+        self.stale_ttl = int(os.environ.get(f"{prefix}_CACHE_STALE_TTL", stale_ttl))
+        self.stats = CacheStats()
+        self._cache = Cache(namespace)
+        self._cache.setup("mem://", size=int(os.environ.get(f"{prefix}_CACHE_SIZE", size)))
+        self._shared_cache = (
+            shared_cache
+            if os.environ.get(f"{prefix}_CACHE_SHARED", str(int(shared))) == "1" else
+            None
+        )
+        # Refreshes left on an abandoned event loop never finish
+        self._refreshing: LoopLocal[Dict[str, "asyncio.Task[None]"]] = LoopLocal(dict)
+        caches[namespace] = self
+
+    async def _get(self, key: str) -> Tuple[Optional[Any], bool]:
+        """Stored value and whether it came from the shared cache."""
+        value = await self._cache.get(key)
+        if value is not None:
+            return value, False
+        if self._shared_cache is not None:
+            value = await self._shared_cache.get(f"{self.namespace}:{key}")
+            if value is not None:
+                await self._cache.set(key, value, expire=self.ttl + self.stale_ttl)
+                return value, True
+        return None, False
+
+    async def get(self, key: str) -> Optional[Any]:
+        value, shared = await self._get(key)
+        if isinstance(value, StaleEntry):
+            value = value.value if value.is_fresh else None
+        if value is None:
+            self.stats.misses += 1
+        elif shared:
+            self.stats.shared_hits += 1
+        else:
+            self.stats.hits += 1
+        return value
+
+    async def get_or_fetch(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[T]]
+    ) -> Tuple[T, bool]:
+        """The value and whether it is stale and being refreshed."""
+        value, shared = await self._get(key)
+        if isinstance(value, StaleEntry):
+            if not value.is_fresh:
+                self.stats.stale_hits += 1
+                self._refresh(key, fetch)
+                return value.value, True
+            value = value.value
+        if value is not None:
+            if shared:
+                self.stats.shared_hits += 1
+            else:
+                self.stats.hits += 1
+            return value, False
+        self.stats.misses += 1
+        value = await fetch()
+        await self.set(key, value)
+        return value, False
+
+    def _refresh(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> None:
+        refreshing = self._refreshing.get()
+        if key in refreshing:
+            return
+
+        async def _fetch_and_set() -> None:
+            try:
+                await self.set(key, await fetch())
+            except Exception:
+                # The stale value is served until it expires
+                logger.exception("Refresh of %s:%s failed", self.namespace, key)
+            finally:
+                refreshing.pop(key, None)
+
+        # Requests of the views go first
+        with priority(Priority.BACKGROUND):
+            refreshing[key] = asyncio.create_task(_fetch_and_set())
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        ttl = ttl or self.ttl
+        if self.stale_ttl:
+            value = StaleEntry(value, time.time() + ttl)
+        await self._cache.set(key, value, expire=ttl + self.stale_ttl)
+        if self._shared_cache is not None:
+            await self._shared_cache.set(
+                f"{self.namespace}:{key}",
+                value,
+                expire=ttl + self.stale_ttl
+            )
+
+
+def cached(
+    cache: NamespaceCache,
+    key: str
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Caches the results of the function, the key is formatted as in single_flight."""
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs) -> T:
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            cache_key = key.format(**arguments.arguments)
+
+            value = await cache.get(cache_key)
+            if value is None:
+                value = await func(*args, **kwargs)
+                await cache.set(cache_key, value)
+            return value
+        return wrapper
+    return decorator
+
+
+caches: Dict[str, NamespaceCache] = {}
+
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {
+        namespace: cache.stats.as_dict()
+        for namespace, cache in caches.items()
+    }
+
+
+svg_cache = NamespaceCache(namespace="svg", size=1000, ttl=CACHE_SECONDS)
+# Bingo cards embed up to 16 posters, about 150 KB a card against a few KB
+# for the other cards, so they get a smaller cache of their own (~15 MB)
+bingo_svg_cache = NamespaceCache(namespace="bingo_svg", size=100, ttl=CACHE_SECONDS)
+# Card data is served stale as long as the CDNs do (stale-while-revalidate).
+# Serverless functions are frozen after the response, so there it is
+# refreshed inline
+CARD_STALE_TTL = 0 if os.environ.get("VERCEL") else 86400
+# Renders of stale data are cached until the refreshed data can be rendered
+CARD_STALE_CACHE_SECONDS = int(os.environ.get("CARD_STALE_CACHE_SECONDS", 60))
+user_card_cache = NamespaceCache(namespace="user_card", size=1000, ttl=CACHE_SECONDS, stale_ttl=CARD_STALE_TTL)
+collection_card_cache = NamespaceCache(namespace="collection_card", size=1000, ttl=CACHE_SECONDS, stale_ttl=CARD_STALE_TTL)
+poster_cache = NamespaceCache(namespace="poster", size=500, ttl=CACHE_SECONDS)
+# Scraped pages with their validators, kept longer than the cards to
+# revalidate them when the cards expire
+page_cache = NamespaceCache(namespace="page", size=2000, ttl=86400)
+# Product data requested by the bingo checks
+PRODUCT_CACHE_SIZE = int(os.environ.get("PRODUCT_CACHE_SIZE", 1000))
+product_info_cache = NamespaceCache(namespace="product_info", size=PRODUCT_CACHE_SIZE, ttl=25 * 60, shared=True)
+# The GraphQL loader has only the fields used by the checks, so its
+# products are not mixed with the REST ones
+product_graphql_cache = NamespaceCache(namespace="product_graphql", size=PRODUCT_CACHE_SIZE, ttl=25 * 60, shared=True)
+product_related_cache = NamespaceCache(namespace="product_related", size=PRODUCT_CACHE_SIZE, ttl=25 * 60, shared=True)
@@ -0,0 +1,72 @@
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from shikithon import ShikimoriAPI
+
+import os
+import asyncio
+from typing import Optional
+
+from .loop_local import LoopLocal
+from .scheduler import ScheduledShikimoriAPI
+
+
+AIOHTTP_LIMIT = int(os.environ.get("AIOHTTP_LIMIT", 100))
+AIOHTTP_LIMIT_PER_HOST = int(os.environ.get("AIOHTTP_LIMIT_PER_HOST", 30))
+AIOHTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("AIOHTTP_KEEPALIVE_TIMEOUT", 60))
+AIOHTTP_DNS_CACHE_TTL = int(os.environ.get("AIOHTTP_DNS_CACHE_TTL", 300))
+
+# Serverless runtimes run each invocation on a new event loop and without
+# the lifespan, so there the clients are closed after each response
+CLIENTS_PER_REQUEST = os.environ.get(
+    "CLIENTS_PER_REQUEST",
+    "1" if os.environ.get("VERCEL") else "0"
+) == "1"
+
+_client_session: LoopLocal[Optional[ClientSession]] = LoopLocal(lambda: None)
+# Concurrent first calls await the same opening client
+_shikimori_api: LoopLocal[Optional["asyncio.Task[ShikimoriAPI]"]] = LoopLocal(lambda: None)
+
+
+def get_client_session() -> ClientSession:
+    # Created lazily, one session per event loop
+    session = _client_session.get()
+    if session is None or session.closed:
+        session = ClientSession(
+            connector=TCPConnector(
+                limit=AIOHTTP_LIMIT,
+                limit_per_host=AIOHTTP_LIMIT_PER_HOST,
+                keepalive_timeout=AIOHTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=AIOHTTP_DNS_CACHE_TTL
+            ),
+            timeout=ClientTimeout(10),
+            trust_env=True
+        )
+        _client_session.set(session)
+    return session
+
+
+async def close_client_session() -> None:
+    session = _client_session.get()
+    if session is not None:
+        _client_session.set(None)
+        await session.close()
+
+
+async def get_shikimori_api() -> ShikimoriAPI:
+    task = _shikimori_api.get()
+    if task is None or (
+        task.done() and (
+            task.cancelled() or
+            task.exception() is not None or
+            task.result().closed
+        )
+    ):
+        task = asyncio.create_task(ScheduledShikimoriAPI().open())
+        _shikimori_api.set(task)
+    return await asyncio.shield(task)
+
+
+async def close_shikimori_api() -> None:
+    task = _shikimori_api.get()
+    if task is not None:
+        _shikimori_api.set(None)
+        await (await task).close()
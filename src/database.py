@@ -1,5 +1,5 @@
-from sqlalchemy import URL, Connection
-from sqlalchemy.pool import NullPool
+from sqlalchemy import URL, Connection, event, select, update, bindparam, table, column
+from sqlalchemy.pool import NullPool, AsyncAdaptedQueuePool
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.ext.asyncio import (
     create_async_engine,
@@ -10,17 +10,64 @@ from sqlalchemy.ext.asyncio import (
 from sqlalchemy import (
     Column,
     Integer,
+    String,
+    Text,
     Date,
+    DateTime,
+    LargeBinary,
     JSON
 )
 from alembic.migration import MigrationContext
 from alembic.autogenerate import produce_migrations
 from alembic.operations import Operations
-from alembic.operations.ops import OpContainer
+from alembic.operations.ops import OpContainer, DropColumnOp
 
 import os
+import time
+import struct
 import asyncio
+from dataclasses import dataclass
 from contextlib import asynccontextmanager
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple, get_args
+
+from .bingo.checks import BINGO_TASKS
+from .bingo.type_hints import ProductType
+
+
+# null - a new connection for every session, for serverless deployments
+# queue - a pool of connections for long running servers
+DB_POOL = os.environ.get("DB_POOL", "null" if os.environ.get("VERCEL") else "queue")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+
+
+@dataclass
+class PoolStats:
+    connects: int = 0
+    checkouts: int = 0
+    wait_seconds: float = 0
+    max_wait_seconds: float = 0
+
+
+pool_stats = PoolStats()
+
+
+def _get_pool_options() -> Dict[str, Any]:
+    if DB_POOL == "queue":
+        return {
+            "poolclass": AsyncAdaptedQueuePool,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": True
+        }
+    return {
+        "poolclass": NullPool # https://docs.sqlalchemy.org/en/20/orm/extensions/asyncio.html#using-multiple-asyncio-event-loops
+    }
 
 
 engine = create_async_engine(
@@ -36,7 +83,7 @@ engine = create_async_engine(
         database=os.environ.get("POSTGRES_DATABASE", "local.db")
     ),
     echo=False,
-    poolclass=NullPool # https://docs.sqlalchemy.org/en/20/orm/extensions/asyncio.html#using-multiple-asyncio-event-loops
+    **_get_pool_options()
 )
 async_session = async_scoped_session(
     async_sessionmaker(
@@ -48,17 +95,111 @@ async_session = async_scoped_session(
 )
 
 
+@event.listens_for(engine.sync_engine, "connect")
+def _on_connect(*_: Any) -> None:
+    pool_stats.connects += 1
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _on_checkout(*_: Any) -> None:
+    pool_stats.checkouts += 1
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    stats = {
+        "pool": DB_POOL,
+        "connects": pool_stats.connects,
+        "checkouts": pool_stats.checkouts
+    }
+    pool = engine.sync_engine.pool
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "wait_ms": round(pool_stats.wait_seconds * 1000, 3),
+            "max_wait_ms": round(pool_stats.max_wait_seconds * 1000, 3)
+        })
+    return stats
+
+
 class Base(DeclarativeBase):
     pass
 
 
+# Bingo cell: task number, product type code (0 if the cell is open)
+# and product id
+BINGO_CELL = struct.Struct("<BBI")
+BINGO_CELL_FORMAT = "BBI"
+# Task numbers start from 1 and are stored in the first byte. More tasks
+# need a wider field and a repack of the stored cards
+if len(BINGO_TASKS) > 255:
+    raise Exception("Task numbers of more than 255 tasks do not fit in BINGO_CELL")
+# Stored in every packed card, so the codes are never changed or reused
+PRODUCT_TYPE_CODES: Mapping[str, int] = MappingProxyType({
+    "anime": 1,
+    "manga": 2,
+    "ranobe": 3
+})
+PRODUCT_TYPES: Mapping[int, str] = MappingProxyType({
+    code: product_type
+    for product_type, code in PRODUCT_TYPE_CODES.items()
+})
+if set(get_args(ProductType)) - set(PRODUCT_TYPE_CODES):
+    raise Exception("Every product type needs a code in PRODUCT_TYPE_CODES")
+
+
+def pack_bingo_stats(bingo_stats: Dict[str, Optional[str]]) -> bytes:
+    values = []
+    for n, product in bingo_stats.items():
+        if product is None:
+            values += (int(n), 0, 0)
+        else:
+            product_type, _, product_id = product.partition("-")
+            values += (int(n), PRODUCT_TYPE_CODES[product_type], int(product_id))
+    return struct.pack("<" + BINGO_CELL_FORMAT * len(bingo_stats), *values)
+
+
+def unpack_bingo_stats(data: bytes) -> Dict[str, Optional[str]]:
+    return {
+        str(n): f"{PRODUCT_TYPES[product_type]}-{product_id}" if product_type else None
+        for n, product_type, product_id in BINGO_CELL.iter_unpack(data)
+    }
+
+
 class BingoCard(Base):
     __tablename__ = "bingo_cards"
 
     user_id = Column(Integer, primary_key=True)
     season_date = Column(Date)
     last_history_id = Column(Integer)
-    stats = Column(JSON, nullable=False)
+    # Cells packed by pack_bingo_stats, read and written through stats
+    stats_data = Column(LargeBinary)
+    # New history entries read by the last scan and its time
+    history_scanned = Column(Integer)
+    scanned_at = Column(DateTime)
+    # Set by the views for the separate refresh worker
+    refresh_requested_at = Column(DateTime)
+
+    @property
+    def stats(self) -> Dict[str, Optional[str]]:
+        return unpack_bingo_stats(self.stats_data)
+
+    @stats.setter
+    def stats(self, bingo_stats: Dict[str, Optional[str]]) -> None:
+        self.stats_data = pack_bingo_stats(bingo_stats)
+
+
+class Poster(Base):
+    __tablename__ = "posters"
+
+    product_type = Column(String(16), primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    data_uri = Column(Text, nullable=False)
+    fetched_at = Column(DateTime, nullable=False)
+    # Validators of the downloaded image for the conditional refetch
+    etag = Column(String(256))
+    last_modified = Column(String(64))
 
 
 async def init_models() -> None:
@@ -67,6 +208,36 @@ async def init_models() -> None:
         await conn.run_sync(Base.metadata.create_all)
 
 
+def _pack_json_bingo_stats(connection: Connection) -> None:
+    bingo_cards = table(
+        "bingo_cards",
+        column("user_id", Integer),
+        column("stats", JSON),
+        column("stats_data", LargeBinary)
+    )
+    rows = connection.execute(
+        select(bingo_cards.c.user_id, bingo_cards.c.stats)
+        .where(bingo_cards.c.stats_data.is_(None))
+    ).all()
+    if len(rows) == 0:
+        return
+    connection.execute(
+        update(bingo_cards)
+        .where(bingo_cards.c.user_id == bindparam("b_user_id"))
+        .values(stats_data=bindparam("b_stats_data")),
+        [
+            {"b_user_id": user_id, "b_stats_data": pack_bingo_stats(stats)}
+            for user_id, stats in rows
+        ]
+    )
+
+
+# Moves the data of a removed column before it is dropped
+DATA_MIGRATIONS: Dict[Tuple[str, str], Callable[[Connection], None]] = {
+    ("bingo_cards", "stats"): _pack_json_bingo_stats
+}
+
+
 async def migrate() -> None:
     # https://stackoverflow.com/a/67238665
 
@@ -74,12 +245,19 @@ async def migrate() -> None:
         mig_ctx = MigrationContext.configure(connection)
         mig_script = produce_migrations(mig_ctx, Base.metadata)
         operation = Operations(mig_ctx)
+        drop_ops = []
         for outer_op in mig_script.upgrade_ops.ops:
-            if isinstance(outer_op, OpContainer):
-                for inner_op in outer_op.ops:
+            inner_ops = outer_op.ops if isinstance(outer_op, OpContainer) else [outer_op]
+            for inner_op in inner_ops:
+                if isinstance(inner_op, DropColumnOp):
+                    drop_ops.append(inner_op)
+                else:
                     operation.invoke(inner_op)
-            else:
-                operation.invoke(outer_op)
+        for drop_op in drop_ops:
+            data_migration = DATA_MIGRATIONS.get((drop_op.table_name, drop_op.column_name))
+            if data_migration is not None:
+                data_migration(connection)
+            operation.invoke(drop_op)
     
     # async with get_db_session() as db:
     async with engine.begin() as conn:
@@ -88,5 +266,16 @@ async def migrate() -> None:
 
 @asynccontextmanager
 async def get_db_session():
-    async with async_session() as session:
-        yield session
+    try:
+        async with async_session() as session:
+            # Time spent waiting for a free connection (or opening a new one)
+            started_at = time.perf_counter()
+            await session.connection()
+            wait_seconds = time.perf_counter() - started_at
+            pool_stats.wait_seconds += wait_seconds
+            pool_stats.max_wait_seconds = max(pool_stats.max_wait_seconds, wait_seconds)
+            yield session
+    finally:
+        # The registry is keyed by task, without this it keeps a session
+        # for every finished request
+        await async_session.remove()
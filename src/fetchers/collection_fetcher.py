@@ -2,7 +2,12 @@ from aiohttp import ClientSession
 from selectolax.parser import HTMLParser
 
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Tuple
+
+from ..cache import collection_card_cache, page_cache
+from ..single_flight import single_flight
+from .html_stream import HTMLStream
+from .conditional import get_conditional_headers, is_not_modified, validate
 
 
 @dataclass(frozen=True)
@@ -15,16 +20,41 @@ class CollectionCard:
     changed_at: Optional[str]
 
 
+async def get_collection_card(
+    client: ClientSession,
+    collection_id: int
+) -> Tuple[CollectionCard, bool]:
+    """The card and whether it is stale and being refreshed."""
+    return await collection_card_cache.get_or_fetch(
+        str(collection_id),
+        lambda: fetch_collection_card(client, collection_id)
+    )
+
+
+@single_flight(key="{collection_id}")
 async def fetch_collection_card(
     client: ClientSession,
     collection_id: int
 ) -> CollectionCard:
-    async with client.request(
+    page = await page_cache.get(f"collection:{collection_id}")
+
+    response = await client.request(
         method="GET",
-        url=f"https://shikimori.one/collections/{collection_id}"
-    ) as response:
+        url=f"https://shikimori.one/collections/{collection_id}",
+        headers=get_conditional_headers(page)
+    )
+    html_stream = HTMLStream(response)
+    try:
+        if page is not None and is_not_modified(response):
+            await page_cache.set(f"collection:{collection_id}", page)
+            return page.data
 
-        html_tree = HTMLParser(await response.text())
+        html_tree = HTMLParser(await html_stream.read_element("b-status-line"))
+        if (
+            html_tree.css_first(".l-page .head > h1") is None or
+            html_tree.css_first(".l-page .inner .b-status-line") is None
+        ):
+            html_tree = HTMLParser(await html_stream.read_all())
         status_line_html = html_tree.css_first(".l-page .inner .b-status-line")
         votes_html = status_line_html.css_first(".critique-votes_count")
 
@@ -35,7 +65,7 @@ async def fetch_collection_card(
         else:
             changed_at = changed_at_html.attrs.get("datetime")
 
-        return CollectionCard(
+        card = CollectionCard(
             title=html_tree.css_first(".l-page .head > h1").text(),
             votes_for=int(votes_html.css_first(".votes-for").text()),
             votes_against=int(votes_html.css_first(".votes-against").text()),
@@ -43,3 +73,10 @@ async def fetch_collection_card(
             comments_count=int(status_line_html.css_first(".comments").text()),
             changed_at=changed_at
         )
+
+        page = validate(response, card)
+        if page.has_validators:
+            await page_cache.set(f"collection:{collection_id}", page)
+        return card
+    finally:
+        html_stream.release()
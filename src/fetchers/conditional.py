@@ -0,0 +1,57 @@
+from aiohttp import ClientResponse
+
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class RevalidationStats:
+    # Conditional requests and those answered with 304 Not Modified
+    requests: int = 0
+    not_modified: int = 0
+
+
+revalidation_stats = RevalidationStats()
+
+
+def get_revalidation_stats() -> Dict[str, Any]:
+    return asdict(revalidation_stats)
+
+
+@dataclass(frozen=True)
+class Validated:
+    """Data parsed from a response, with the validators of the response."""
+    data: Any
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def has_validators(self) -> bool:
+        return self.etag is not None or self.last_modified is not None
+
+
+def get_conditional_headers(validated: Optional[Validated]) -> Dict[str, str]:
+    headers = {}
+    if validated is not None:
+        if validated.etag is not None:
+            headers["If-None-Match"] = validated.etag
+        if validated.last_modified is not None:
+            headers["If-Modified-Since"] = validated.last_modified
+    if headers:
+        revalidation_stats.requests += 1
+    return headers
+
+
+def is_not_modified(response: ClientResponse) -> bool:
+    if response.status == 304:
+        revalidation_stats.not_modified += 1
+        return True
+    return False
+
+
+def validate(response: ClientResponse, data: Any) -> Validated:
+    return Validated(
+        data=data,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified")
+    )
@@ -0,0 +1,99 @@
+from aiohttp import ClientResponse
+
+import os
+import re
+import asyncio
+import logging
+from typing import Set
+
+from ..loop_local import LoopLocal
+
+
+logger = logging.getLogger(__name__)
+
+HTML_CHUNK_SIZE = int(os.environ.get("HTML_CHUNK_SIZE", 16 * 1024))
+# Start tags longer than this can be missed when cut by a chunk
+MAX_TAG_LENGTH = 4096
+# The rest of a longer page is not read, its connection is closed
+HTML_DRAIN_LIMIT = int(os.environ.get("HTML_DRAIN_LIMIT", 2 * 1024 * 1024))
+
+_drain_tasks: LoopLocal[Set["asyncio.Task[None]"]] = LoopLocal(set)
+
+
+async def _drain(response: ClientResponse) -> None:
+    try:
+        drained = 0
+        async for chunk in response.content.iter_chunked(HTML_CHUNK_SIZE):
+            drained += len(chunk)
+            if drained > HTML_DRAIN_LIMIT:
+                response.close()
+                return
+    except Exception:
+        logger.debug("Reading the rest of %s failed", response.url, exc_info=True)
+        response.close()
+    else:
+        response.release()
+
+
+class HTMLStream:
+    """Reads an HTML page only as far as the scraped part of it."""
+
+    def __init__(self, response: ClientResponse) -> None:
+        self._response = response
+        self._buffer = bytearray()
+        self._encoding = response.charset or "utf-8"
+
+    def _decode(self, data: bytes) -> str:
+        return data.decode(self._encoding, errors="replace")
+
+    async def read_element(self, class_name: str) -> str:
+        """Page up to the end of the first element with the class.
+
+        The whole page if the element is not found or not closed.
+        """
+        start_re = re.compile(
+            rb'<([a-zA-Z][\w-]*)\s[^>]*?class="(?:[^"]*\s)?' +
+            re.escape(class_name.encode()) +
+            rb'(?:\s[^"]*)?"[^>]*>'
+        )
+        tag_re = None
+        depth = 0
+        position = 0
+        async for chunk in self._response.content.iter_chunked(HTML_CHUNK_SIZE):
+            self._buffer += chunk
+            if tag_re is None:
+                match = start_re.search(self._buffer, position)
+                if match is None:
+                    position = max(0, len(self._buffer) - MAX_TAG_LENGTH)
+                    continue
+                tag_re = re.compile(
+                    rb"<(/?)" + re.escape(match.group(1)) + rb"[\s/>]",
+                    re.IGNORECASE
+                )
+                depth = 1
+                position = match.end()
+            # A tag cut by the chunk end is matched with the next chunk
+            for match in tag_re.finditer(self._buffer, position):
+                position = match.end()
+                depth += -1 if match.group(1) else 1
+                if depth == 0:
+                    return self._decode(self._buffer[:position])
+        return self._decode(self._buffer)
+
+    async def read_all(self) -> str:
+        self._buffer += await self._response.content.read()
+        return self._decode(self._buffer)
+
+    def release(self) -> None:
+        """Returns the connection to the pool.
+
+        An unread rest of the page is read in the background first, aiohttp
+        would close the connection instead.
+        """
+        if self._response.content.at_eof():
+            self._response.release()
+            return
+        tasks = _drain_tasks.get()
+        task = asyncio.create_task(_drain(self._response))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
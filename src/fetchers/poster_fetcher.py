@@ -0,0 +1,186 @@
+from aiohttp import ClientSession
+from PIL import Image
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import os
+import asyncio
+from io import BytesIO
+from base64 import b64encode
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from ..cache import poster_cache
+from ..database import Poster
+from ..single_flight import single_flight
+from .conditional import Validated, get_conditional_headers, is_not_modified, validate
+
+
+POSTER_TTL = int(os.environ.get("POSTER_TTL", 7 * 86400))
+# Posters are shown in the bingo card cells, 150x200
+POSTER_SIZE: Tuple[int, int] = (
+    int(os.environ.get("POSTER_WIDTH", 150)),
+    int(os.environ.get("POSTER_HEIGHT", 200))
+)
+POSTER_FORMAT = os.environ.get("POSTER_FORMAT", "jpeg").lower()
+POSTER_QUALITY = int(os.environ.get("POSTER_QUALITY", 80))
+
+
+def get_poster_url(product_type: str, product_id: int) -> str:
+    return "https://shikimori.one/" + (
+        "system/animes/preview/{}.jpg"
+        if product_type == "anime" else
+        "system/mangas/preview/{}.jpg"
+    ).format(product_id)
+
+
+async def get_posters(
+    db: AsyncSession,
+    client: ClientSession,
+    products: List[str]
+) -> Dict[str, str]:
+    """Poster data URIs by "{product_type}-{product_id}".
+
+    Looks in memory, then in the database and downloads only the posters
+    that are missing or older than POSTER_TTL. The older ones are
+    downloaded only if they have changed. Commits the session.
+    """
+    posters = {}
+    missing = []
+    for product in set(products):
+        data_uri = await poster_cache.get(product)
+        if data_uri is None:
+            missing.append(product)
+        else:
+            posters[product] = data_uri
+
+    if missing:
+        keys = []
+        for product in missing:
+            product_type, product_id = product.split("-")
+            keys.append((product_type, int(product_id)))
+
+        rows = (await db.execute(
+            select(
+                Poster.product_type,
+                Poster.product_id,
+                Poster.data_uri,
+                Poster.fetched_at,
+                Poster.etag,
+                Poster.last_modified
+            ).where(tuple_(Poster.product_type, Poster.product_id).in_(keys))
+        )).all()
+        # No connection is held while the posters are downloaded
+        await db.commit()
+
+        expired_at = datetime.now() - timedelta(seconds=POSTER_TTL)
+        stored: Dict[str, Validated] = {}
+        for row in rows:
+            product = f"{row.product_type}-{row.product_id}"
+            stored[product] = Validated(row.data_uri, row.etag, row.last_modified)
+            if row.fetched_at > expired_at:
+                posters[product] = row.data_uri
+                await poster_cache.set(product, row.data_uri)
+
+        fetch_keys = [
+            key for key in keys
+            if f"{key[0]}-{key[1]}" not in posters
+        ]
+        fetched = await asyncio.gather(*[
+            fetch_poster(
+                client,
+                product_type,
+                product_id,
+                stored.get(f"{product_type}-{product_id}")
+            )
+            for product_type, product_id in fetch_keys
+        ])
+
+        fetched_posters = []
+        fetched_at = datetime.now()
+        for (product_type, product_id), poster_page in zip(fetch_keys, fetched):
+            if poster_page is None:
+                continue
+            product = f"{product_type}-{product_id}"
+            posters[product] = poster_page.data
+            await poster_cache.set(product, poster_page.data)
+            fetched_posters.append({
+                "product_type": product_type,
+                "product_id": product_id,
+                "data_uri": poster_page.data,
+                "fetched_at": fetched_at,
+                "etag": poster_page.etag,
+                "last_modified": poster_page.last_modified
+            })
+
+        if fetched_posters:
+            insert = (
+                postgresql.insert
+                if db.get_bind().dialect.name == "postgresql" else
+                sqlite.insert
+            )
+            statement = insert(Poster)
+            # The expired posters are replaced, and the ones stored by a
+            # concurrent request meanwhile too
+            await db.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[Poster.product_type, Poster.product_id],
+                    set_={
+                        "data_uri": statement.excluded.data_uri,
+                        "fetched_at": statement.excluded.fetched_at,
+                        "etag": statement.excluded.etag,
+                        "last_modified": statement.excluded.last_modified
+                    }
+                ),
+                fetched_posters
+            )
+            await db.commit()
+
+    return {
+        product: posters[product]
+        for product in products
+        if product in posters
+    }
+
+
+@single_flight(key="{product_type}-{product_id}")
+async def fetch_poster(
+    client: ClientSession,
+    product_type: str,
+    product_id: int,
+    stored: Optional[Validated] = None
+) -> Optional[Validated]:
+    """Poster data URI, the stored one if the poster has not changed."""
+    async with client.get(
+        get_poster_url(product_type, product_id),
+        headers=get_conditional_headers(stored)
+    ) as resp:
+        if stored is not None and is_not_modified(resp):
+            return stored
+        if resp.status != 200:
+            return None
+        image = await resp.read()
+    return validate(resp, await asyncio.to_thread(process_poster, image))
+
+
+def process_poster(image: bytes) -> str:
+    """Downscales the poster to the cell size and returns its data URI."""
+    try:
+        with Image.open(BytesIO(image)) as img:
+            # Lets the JPEG decoder skip the detail that is thrown away anyway
+            img.draft("RGB", POSTER_SIZE)
+            img = img.convert("RGB")
+            img.thumbnail(POSTER_SIZE, Image.LANCZOS)
+            output = BytesIO()
+            img.save(output, format=POSTER_FORMAT, quality=POSTER_QUALITY)
+    except OSError:
+        return "data:image/jpeg;base64," + b64encode(image).decode("ascii")
+
+    if output.tell() >= len(image):
+        # Already small enough, recompressing would only lose quality
+        return "data:image/jpeg;base64," + b64encode(image).decode("ascii")
+    return (
+        f"data:image/{POSTER_FORMAT};base64," +
+        b64encode(output.getvalue()).decode("ascii")
+    )
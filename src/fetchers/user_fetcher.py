@@ -7,6 +7,11 @@ import asyncio
 from dataclasses import dataclass
 from typing import Any, Union, Dict, Tuple
 
+from ..cache import user_card_cache, page_cache
+from ..single_flight import single_flight
+from .html_stream import HTMLStream
+from .conditional import get_conditional_headers, is_not_modified, validate
+
 
 ANIME_MANGA_MEAN = 125
 ANIME_MANGA_WEIGHT = 2
@@ -89,6 +94,24 @@ def get_score_count(scores: Dict[str, Any]) -> int:
     return s
 
 
+async def get_user_card(
+    client: ClientSession,
+    api: ShikimoriAPI,
+    user_id: Union[str, int]
+) -> Tuple[UserCard, bool]:
+    """The card and whether it is stale and being refreshed."""
+    key = f"nickname:{user_id}" if isinstance(user_id, str) else f"id:{user_id}"
+
+    async def fetch() -> UserCard:
+        card = await fetch_user_card(client, api, user_id)
+        # The same card is reachable both by id and by nickname
+        await user_card_cache.set(f"id:{card.info.id}", card)
+        await user_card_cache.set(f"nickname:{card.info.nickname}", card)
+        return card
+
+    return await user_card_cache.get_or_fetch(key, fetch)
+
+
 async def fetch_user_card(
     client: ClientSession,
     api: ShikimoriAPI,
@@ -128,6 +151,7 @@ async def fetch_user_card(
     return UserCard(user_info, rank, score)
 
 
+@single_flight(key="{user_id!r}")
 async def fetch_api_user(
     api: ShikimoriAPI,
     user_id: Union[str, int]
@@ -141,21 +165,37 @@ async def fetch_api_user(
     )
 
 
+@single_flight(key="{user_name}")
 async def fetch_html_user(
     client: ClientSession,
     user_name: str
 ) -> Dict[str, Any]:
     result = {}
+    page = await page_cache.get(f"user:{user_name}")
 
-    async with client.request(
+    response = await client.request(
         method="GET",
-        url="https://shikimori.one/" + user_name
-    ) as response:
-        html_tree = HTMLParser(await response.text())
+        url="https://shikimori.one/" + user_name,
+        headers=get_conditional_headers(page)
+    )
+    html_stream = HTMLStream(response)
+    try:
+        if page is not None and is_not_modified(response):
+            await page_cache.set(f"user:{user_name}", page)
+            return page.data
+
+        # The counters are at the top of the page
+        html_tree = HTMLParser(await html_stream.read_element("c-additionals"))
         activities = html_tree.css(".profile-head .c-additionals > div")
         for activity in activities:
             _type = activity.attributes["data-type"]
             count = int(activity.text().split()[0])
             result[_type] = count
+
+        page = validate(response, result)
+        if page.has_validators:
+            await page_cache.set(f"user:{user_name}", page)
+    finally:
+        html_stream.release()
     
     return result
@@ -0,0 +1,188 @@
+import os
+import re
+import pickle
+import hashlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+
+HYPHENATION_CACHE_SIZE = int(os.environ.get("HYPHENATION_CACHE_SIZE", 4096))
+DIGITS = "0123456789"
+# libhyphen hyphenates words with these characters as compounds (and it
+# limits words to 100 bytes), such words are passed to PyHyphen itself
+COMPOUND_CHARS = ("-", "'", "–", "’")
+MAX_WORD_BYTES = 100
+
+# Compiled pattern automaton: state -> fallback state, state -> match
+Automaton = Tuple[Dict[str, Optional[str]], Dict[str, str]]
+
+
+def compile_dictionary(dic_path: str) -> Automaton:
+    """Builds the libhyphen pattern automaton from a .dic file."""
+    patterns = []
+    matches = {}
+    with open(dic_path, encoding="utf-8") as f:
+        # The first line is the encoding
+        for line in f.read().split("\n")[1:]:
+            if not line:
+                continue
+            letters = re.sub(r"\d", "", line)
+            patterns.append(letters)
+            digits = ["0"] * (len(letters) + 1)
+            i = 0
+            for c in line:
+                if c.isdigit():
+                    digits[i] = c
+                else:
+                    i += 1
+            match = "".join(digits).lstrip("0")
+            if match:
+                matches[letters] = match
+
+    states = {""}
+    for letters in patterns:
+        for i in range(1, len(letters) + 1):
+            states.add(letters[:i])
+
+    fallbacks = {}
+    for state in states:
+        fallback = None
+        for i in range(1, len(state) + 1):
+            if state[i:] in states:
+                fallback = state[i:]
+                break
+        fallbacks[state] = fallback
+    return fallbacks, matches
+
+
+class CompiledHyphenator:
+    """Pure Python reimplementation of libhyphen used by PyHyphen.
+
+    Gives the same pairs as hyphen.Hyphenator for the same dictionary, but
+    loads a precompiled automaton instead of importing PyHyphen (which pulls
+    in requests) and parsing the .dic file on every cold start.
+    """
+
+    def __init__(
+        self,
+        language: str = "ru_RU",
+        directory: str = "pyhyphen",
+        lmin: int = 2,
+        rmin: int = 2
+    ) -> None:
+        self.language = language
+        self.directory = directory
+        self.lmin = lmin
+        self.rmin = rmin
+        self._fallbacks, self._matches = load_automaton(
+            os.path.join(directory, f"hyph_{language}.dic")
+        )
+        self._fallback_hyphenator = None
+        self._pairs = lru_cache(maxsize=HYPHENATION_CACHE_SIZE)(self._compute_pairs)
+
+    def pairs(self, word: str) -> List[List[str]]:
+        # Cached pairs are immutable, callers are free to modify the result
+        return [list(pair) for pair in self._pairs(word)]
+
+    def _compute_pairs(self, word: str) -> Tuple[Tuple[str, str], ...]:
+        if len(word) < 4 or "=" in word:
+            return ()
+        if (
+            any(c in word for c in COMPOUND_CHARS) or
+            len(word.encode()) >= MAX_WORD_BYTES
+        ):
+            return tuple(map(tuple, self._get_fallback_hyphenator().pairs(word)))
+
+        is_upper = word.isupper()
+        if is_upper:
+            word = word.lower()
+
+        points = self._hyphenation_points(word)
+        size = len(word)
+        # Leading and trailing digits do not count towards the minimums
+        lmin = self.lmin - 1 + size - len(word.lstrip(DIGITS))
+        rmin = self.rmin
+        for i in range(size - 1, 0, -1):
+            if word[i] not in DIGITS:
+                break
+            rmin += 1
+
+        pairs = []
+        for i in range(lmin, size - rmin):
+            if points[i] % 2 == 1:
+                if is_upper:
+                    pairs.append((word[:i + 1].upper(), word[i + 1:].upper()))
+                else:
+                    pairs.append((word[:i + 1], word[i + 1:]))
+        return tuple(pairs)
+
+    def _hyphenation_points(self, word: str) -> List[int]:
+        fallbacks = self._fallbacks
+        matches = self._matches
+        prep_word = "." + "".join(["." if c in DIGITS else c for c in word]) + "."
+        points = [0] * (len(prep_word) + 1)
+        state = ""
+        for i, c in enumerate(prep_word):
+            # Same walk as the libhyphen state machine, only the match of the
+            # reached state is applied
+            while state is not None:
+                next_state = state + c
+                if next_state in fallbacks:
+                    state = next_state
+                    match = matches.get(state)
+                    if match is not None:
+                        offset = i + 1 - len(match)
+                        for k, digit in enumerate(match):
+                            digit = int(digit)
+                            if points[offset + k] < digit:
+                                points[offset + k] = digit
+                    break
+                state = fallbacks[state]
+            else:
+                state = ""
+        # points[i] is the value after prep_word[i]
+        return points[1:len(word) + 1]
+
+    def _get_fallback_hyphenator(self):
+        if self._fallback_hyphenator is None:
+            from hyphen import Hyphenator
+            self._fallback_hyphenator = Hyphenator(
+                self.language,
+                lmin=self.lmin,
+                rmin=self.rmin,
+                directory=self.directory
+            )
+        return self._fallback_hyphenator
+
+
+def _dictionary_hash(dic_path: str) -> str:
+    with open(dic_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def load_automaton(dic_path: str) -> Automaton:
+    # The compiled automaton is used only if it was built from the same .dic
+    compiled_path = os.path.splitext(dic_path)[0] + ".pickle"
+    if os.path.exists(compiled_path):
+        with open(compiled_path, "rb") as f:
+            dictionary_hash, automaton = pickle.load(f)
+        if dictionary_hash == _dictionary_hash(dic_path):
+            return automaton
+    return compile_dictionary(dic_path)
+
+
+def save_automaton(dic_path: str) -> None:
+    compiled_path = os.path.splitext(dic_path)[0] + ".pickle"
+    with open(compiled_path, "wb") as f:
+        pickle.dump(
+            (_dictionary_hash(dic_path), compile_dictionary(dic_path)),
+            f,
+            protocol=4
+        )
+
+
+if __name__ == "__main__":
+    # python -m src.hyphenation pyhyphen/hyph_ru_RU.dic
+    import sys
+    for path in sys.argv[1:]:
+        save_automaton(path)
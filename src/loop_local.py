@@ -0,0 +1,31 @@
+import asyncio
+import weakref
+from typing import Callable, Generic, Optional, TypeVar
+
+
+T = TypeVar("T")
+
+
+class LoopLocal(Generic[T]):
+    """Value bound to the running event loop, created again on another loop.
+
+    Futures, tasks and aiohttp sessions only work on the loop they were
+    created on, while serverless runtimes (Vercel) run each invocation on a
+    new loop. The value of the previous loop is dropped.
+    """
+
+    def __init__(self, factory: Callable[[], T]) -> None:
+        self._factory = factory
+        self._loop: Optional["weakref.ref[asyncio.AbstractEventLoop]"] = None
+        self._value: Optional[T] = None
+
+    def get(self) -> T:
+        loop = asyncio.get_running_loop()
+        if self._loop is None or self._loop() is not loop:
+            self._value = self._factory()
+            self._loop = weakref.ref(loop)
+        return self._value
+
+    def set(self, value: T) -> None:
+        self._loop = weakref.ref(asyncio.get_running_loop())
+        self._value = value
@@ -0,0 +1,144 @@
+from shikithon import ShikimoriAPI
+from shikithon.base_client import Client
+from shikithon.exceptions import RetryLater
+
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from enum import IntEnum
+from contextvars import ContextVar
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Tuple
+
+from .loop_local import LoopLocal
+
+
+SHIKIMORI_RPS = float(os.environ.get("SHIKIMORI_RPS", 5))
+SHIKIMORI_RPM = float(os.environ.get("SHIKIMORI_RPM", 90))
+SHIKIMORI_MAX_RETRIES = int(os.environ.get("SHIKIMORI_MAX_RETRIES", 5))
+SHIKIMORI_MAX_BACKOFF = float(os.environ.get("SHIKIMORI_MAX_BACKOFF", 60))
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+request_priority: ContextVar[Priority] = ContextVar(
+    "request_priority",
+    default=Priority.INTERACTIVE
+)
+
+
+@contextmanager
+def priority(value: Priority) -> Iterator[None]:
+    token = request_priority.set(value)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self._tokens -= 1
+
+
+class WaiterQueue:
+    def __init__(self) -> None:
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.dispatcher: Optional[asyncio.Task] = None
+
+
+class RequestScheduler:
+    def __init__(self, *buckets: TokenBucket) -> None:
+        self._buckets = buckets
+        # The waiters and their dispatcher belong to the event loop, the
+        # buckets and the backoff are shared by the loops of the process
+        self._queue: LoopLocal[WaiterQueue] = LoopLocal(WaiterQueue)
+        self._counter = itertools.count()
+        self._backoff = 0.0
+        self._backoff_until = 0.0
+
+    async def acquire(self, priority: Optional[Priority] = None) -> None:
+        if priority is None:
+            priority = request_priority.get()
+        queue = self._queue.get()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(queue.waiters, (priority, next(self._counter), future))
+        if queue.dispatcher is None or queue.dispatcher.done():
+            queue.dispatcher = asyncio.create_task(self._dispatch(queue))
+        await future
+
+    async def _dispatch(self, queue: WaiterQueue) -> None:
+        while queue.waiters:
+            now = time.monotonic()
+            delay = max(
+                self._backoff_until - now,
+                *[bucket.delay(now) for bucket in self._buckets]
+            )
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(queue.waiters)
+            if future.done():
+                # The waiter was cancelled
+                continue
+            for bucket in self._buckets:
+                bucket.take(now)
+            future.set_result(None)
+
+    def backoff(self) -> None:
+        self._backoff = min(max(self._backoff * 2, 1), SHIKIMORI_MAX_BACKOFF)
+        self._backoff_until = time.monotonic() + self._backoff
+
+    def reset_backoff(self) -> None:
+        self._backoff = 0
+
+
+scheduler = RequestScheduler(
+    TokenBucket(rate=SHIKIMORI_RPS, capacity=SHIKIMORI_RPS),
+    # A burst plus the refill never exceeds the limit in any 60 seconds window
+    TokenBucket(
+        rate=(SHIKIMORI_RPM - SHIKIMORI_RPS) / 60,
+        capacity=SHIKIMORI_RPS
+    )
+)
+
+
+class ScheduledShikimoriAPI(ShikimoriAPI):
+    async def request(self, *args, **kwargs) -> Any:
+        for _ in range(SHIKIMORI_MAX_RETRIES):
+            await scheduler.acquire()
+            try:
+                # Bypass the shikithon backoff so that retries go through
+                # the scheduler too
+                response = await Client.request.__wrapped__(self, *args, **kwargs)
+            except RetryLater:
+                scheduler.backoff()
+                continue
+            scheduler.reset_backoff()
+            return response
+        raise RetryLater("Shikimori API rate limit retries exceeded")
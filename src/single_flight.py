@@ -0,0 +1,42 @@
+import asyncio
+import inspect
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+from .loop_local import LoopLocal
+
+
+T = TypeVar("T")
+
+# A call left in flight on an abandoned event loop never finishes
+_in_flight: LoopLocal[Dict[str, "asyncio.Future[Any]"]] = LoopLocal(dict)
+
+
+def single_flight(
+    key: str
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Concurrent calls with the same formatted key await one shared call.
+
+    The key is formatted with the call arguments, e.g. "user-{user_id!r}".
+    """
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs) -> T:
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            flight_key = f"{func.__qualname__}:" + key.format(**arguments.arguments)
+
+            in_flight = _in_flight.get()
+            future = in_flight.get(flight_key)
+            if future is None:
+                future = asyncio.ensure_future(func(*args, **kwargs))
+                in_flight[flight_key] = future
+                future.add_done_callback(
+                    lambda _: in_flight.pop(flight_key, None)
+                )
+            # A cancelled caller must not cancel the call for the others
+            return await asyncio.shield(future)
+        return wrapper
+    return decorator
@@ -0,0 +1,55 @@
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+import os
+import hashlib
+from typing import Any, Optional
+
+from .utils import calculate_ring_progress
+
+
+TEMPLATES_DIRECTORY = "src/cards/"
+# Bytecode is shared between processes and survives restarts, so serverless
+# cold starts skip the compilation step. For example /tmp/jinja on Vercel
+JINJA_BYTECODE_CACHE = os.environ.get("JINJA_BYTECODE_CACHE")
+
+
+def _create_bytecode_cache() -> Optional[FileSystemBytecodeCache]:
+    if not JINJA_BYTECODE_CACHE:
+        return None
+    os.makedirs(JINJA_BYTECODE_CACHE, exist_ok=True)
+    return FileSystemBytecodeCache(JINJA_BYTECODE_CACHE)
+
+
+jinja_env = Environment(
+    trim_blocks=True,
+    loader=FileSystemLoader(TEMPLATES_DIRECTORY),
+    auto_reload=False,
+    bytecode_cache=_create_bytecode_cache()
+)
+jinja_env.globals["calculateRingProgress"] = calculate_ring_progress
+
+
+def _get_templates_version() -> str:
+    # The deployed commit covers changes of the views too
+    digest = hashlib.sha1(os.environ.get("VERCEL_GIT_COMMIT_SHA", "").encode())
+    for name in sorted(jinja_env.list_templates()):
+        source, _, _ = jinja_env.loader.get_source(jinja_env, name)
+        digest.update(source.encode())
+    return digest.hexdigest()
+
+
+TEMPLATES_VERSION = _get_templates_version()
+
+
+def card_etag(cache_key: str, data: Any) -> str:
+    """Strong ETag of a card rendered from the data with the options of the key."""
+    digest = hashlib.sha1(repr((TEMPLATES_VERSION, cache_key, data)).encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def precompile_templates() -> None:
+    for name in jinja_env.list_templates():
+        jinja_env.get_template(name)
+
+
+precompile_templates()
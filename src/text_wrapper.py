@@ -1,10 +1,13 @@
-from hyphen import Hyphenator
-
+import os
 from textwrap import TextWrapper
-from typing import Optional, List
+from functools import lru_cache
+from typing import Optional, List, Dict, Tuple
+
+from .hyphenation import CompiledHyphenator
 
 
-HYPHENATOR = Hyphenator("ru_RU", directory="pyhyphen")
+HYPHENATOR = CompiledHyphenator("ru_RU", directory="pyhyphen")
+WRAP_CACHE_SIZE = int(os.environ.get("WRAP_CACHE_SIZE", 1024))
 
 # Sans-Serif font
 LETTER_WIDTHS = {
@@ -40,6 +43,12 @@ KERN_MODS = {
     'Yv': -0.05467, 'ff': -0.01766, 'r,': -0.05466, 'r.': -0.05466, 'v,': -0.07366, 'v.': -0.07366,
     'w,': -0.05467, 'w.': -0.05467, 'y,': -0.07366, 'y.': -0.07366
 }
+MEDIAN_WIDTH = LETTER_WIDTHS["_median"]
+# Kerning modifiers indexed by the first letter of a pair, so that measuring
+# does not build a pair string for every character
+KERN_PAIRS: Dict[str, Dict[str, float]] = {}
+for _pair, _mod in KERN_MODS.items():
+    KERN_PAIRS.setdefault(_pair[0], {})[_pair[1]] = _mod
 
 
 class PixelTextWrapper(TextWrapper):
@@ -47,13 +56,20 @@ class PixelTextWrapper(TextWrapper):
         self,
         *args,
         font_size: int = 12,
-        use_hyphenator: Optional[Hyphenator] = None,
+        use_hyphenator: Optional[CompiledHyphenator] = None,
         **kwargs
     ):
         self.font_size = font_size
         self.use_hyphenator = use_hyphenator
+        self._widths: Dict[str, float] = {}
         super().__init__(*args, **kwargs)
 
+    def _measure(self, text: str) -> float:
+        width = self._widths.get(text)
+        if width is None:
+            width = self._widths[text] = measure_text(text, self.font_size)
+        return width
+
     def _handle_long_word(self, reversed_chunks, cur_line, cur_width, width):
         if width < 1 * self.font_size:
             space_left = 1 * self.font_size
@@ -63,7 +79,7 @@ class PixelTextWrapper(TextWrapper):
         if self.break_long_words:
             end = int(space_left // self.font_size)
             chunk = reversed_chunks[-1]
-            if self.break_on_hyphens and measure_text(chunk, self.font_size) > space_left:
+            if self.break_on_hyphens and self._measure(chunk) > space_left:
                 hyphen = chunk.rfind('-', 0, int(space_left // self.font_size))
                 if hyphen > 0 and any(c != '-' for c in chunk[:hyphen]):
                     end = hyphen + 1
@@ -73,6 +89,7 @@ class PixelTextWrapper(TextWrapper):
             cur_line.append(reversed_chunks.pop())
 
     def _wrap_chunks(self, chunks):
+        self._widths = {}
         lines = []
         if self.width <= 0:
             raise ValueError("invalid width %r (must be > 0)" % self.width)
@@ -81,7 +98,7 @@ class PixelTextWrapper(TextWrapper):
                 indent = self.subsequent_indent
             else:
                 indent = self.initial_indent
-            if measure_text(indent + self.placeholder.lstrip(), self.font_size) > self.width:
+            if self._measure(indent + self.placeholder.lstrip()) > self.width:
                 raise ValueError("placeholder too large for max width")
 
         chunks.reverse()
@@ -96,13 +113,13 @@ class PixelTextWrapper(TextWrapper):
             else:
                 indent = self.initial_indent
 
-            width = self.width - measure_text(indent, self.font_size)
+            width = self.width - self._measure(indent)
 
             if self.drop_whitespace and chunks[-1].strip() == '' and lines:
                 del chunks[-1]
 
             while chunks:
-                w = measure_text(chunks[-1], self.font_size)
+                w = self._measure(chunks[-1])
 
                 if cur_width + w <= width:
                     cur_line.append(chunks.pop())
@@ -110,7 +127,7 @@ class PixelTextWrapper(TextWrapper):
                 else:
                     if self.use_hyphenator and (width - cur_width >= 2 * self.font_size):
                         hyphen = "-"
-                        hyphen_width = measure_text(hyphen, self.font_size)
+                        hyphen_width = self._measure(hyphen)
                         word_pairs = self.use_hyphenator.pairs(chunks[-1])
                         max_word_width = width - cur_width - hyphen_width
                         while word_pairs:
@@ -118,7 +135,7 @@ class PixelTextWrapper(TextWrapper):
                                 cur_max_width = max_word_width - hyphen_width
                             else:
                                 cur_max_width = max_word_width
-                            if measure_text(word_pairs[-1][0], self.font_size) > cur_max_width:
+                            if self._measure(word_pairs[-1][0]) > cur_max_width:
                                 word_pairs.pop()
                             else:
                                 break
@@ -134,12 +151,12 @@ class PixelTextWrapper(TextWrapper):
                             hyphenated_last = True
                     break
 
-            if chunks and measure_text(chunks[-1], self.font_size) > width and not hyphenated_last:
+            if chunks and self._measure(chunks[-1]) > width and not hyphenated_last:
                 self._handle_long_word(chunks, cur_line, cur_width, width)
-                cur_width= sum([measure_text(i, self.font_size) for i in cur_line])
+                cur_width= sum([self._measure(i) for i in cur_line])
 
             if self.drop_whitespace and cur_line and cur_line[-1].strip() == '':
-                cur_width -= measure_text(cur_line[-1], self.font_size)
+                cur_width -= self._measure(cur_line[-1])
                 del cur_line[-1]
 
             if cur_line:
@@ -154,16 +171,16 @@ class PixelTextWrapper(TextWrapper):
                 else:
                     while cur_line:
                         if (cur_line[-1].strip() and
-                            cur_width + measure_text(self.placeholder, self.font_size) <= width):
+                            cur_width + self._measure(self.placeholder) <= width):
                             cur_line.append(self.placeholder)
                             lines.append(indent + ''.join(cur_line))
                             break
-                        cur_width -= measure_text(cur_line[-1], self.font_size)
+                        cur_width -= self._measure(cur_line[-1])
                         del cur_line[-1]
                     else:
                         if lines:
                             prev_line = lines[-1].rstrip()
-                            if measure_text(prev_line + self.placeholder, self.font_size) <= self.width:
+                            if self._measure(prev_line + self.placeholder) <= self.width:
                                 lines[-1] = prev_line + self.placeholder
                                 break
                         lines.append(indent + self.placeholder.lstrip())
@@ -172,26 +189,45 @@ class PixelTextWrapper(TextWrapper):
         return lines
     
 
-def wrap_text_multiline(
+@lru_cache(maxsize=WRAP_CACHE_SIZE)
+def _wrap_text_multiline(
     text: str,
     width: int,
-    font_size: int = 10,
-    max_lines: int = 3
-) -> List[str]:
-    return PixelTextWrapper(
+    font_size: int,
+    max_lines: int
+) -> Tuple[str, ...]:
+    return tuple(PixelTextWrapper(
         width=width,
         font_size=font_size,
         use_hyphenator=HYPHENATOR,
         max_lines=max_lines,
         placeholder=" ..."
-    ).wrap(text)
+    ).wrap(text))
+
+
+def wrap_text_multiline(
+    text: str,
+    width: int,
+    font_size: int = 10,
+    max_lines: int = 3
+) -> List[str]:
+    # Memoized result is immutable, callers get their own list
+    return list(_wrap_text_multiline(text, width, font_size, max_lines))
 
 
 def measure_text(text: str, font_size: int = 10) -> float:
     """https://chrishewett.com/blog/calculating-text-width-programmatically/?"""
+    letter_widths = LETTER_WIDTHS
+    kern_pairs = KERN_PAIRS
     width = 0
-    for idx, c in enumerate(list(text)):
-        width += LETTER_WIDTHS.get(c) or LETTER_WIDTHS.get("_median")
-        if idx != len(text) - 1:
-            width += KERN_MODS.get(f"{c}{text[idx + 1]}") or 0
+    kerns = None
+    # Same summation order as adding the letter width and then the kerning
+    # with the next letter, so the results are bit for bit identical
+    for c in text:
+        if kerns is not None:
+            mod = kerns.get(c)
+            if mod is not None:
+                width += mod
+        width += letter_widths.get(c, MEDIAN_WIDTH)
+        kerns = kern_pairs.get(c)
     return width * font_size
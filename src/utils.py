@@ -1,22 +1,54 @@
+from starlette.requests import Request
 from starlette.responses import Response
 
 import math
 from re import search
-from email.utils import formatdate
-from typing import Optional
+from typing import Any, Callable, Dict, Mapping, Optional, Union
+
+
+CACHE_SECONDS = 3600
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is None:
+        return False
+    # If-None-Match uses the weak comparison
+    return any([
+        tag.strip().removeprefix("W/") in ("*", etag)
+        for tag in if_none_match.split(",")
+    ])
+
+
+def send_not_modified(
+    etag: str,
+    cache_seconds: int = CACHE_SECONDS,
+    swr_seconds: int = 86400
+) -> Response:
+    return Response(
+        status_code=304,
+        headers={
+            "ETag": etag,
+            "Cache-Control": f"max-age={cache_seconds // 2}, s-maxage={cache_seconds}, stale-while-revalidate={swr_seconds}"
+        }
+    )
 
 
 def send_svg_file(
-    svg_text: str,
+    request: Request,
+    svg_text: Union[str, bytes],
     file_name: str,
-    cache_seconds: int = 3600,
+    etag: str,
+    cache_seconds: int = CACHE_SECONDS,
     swr_seconds: int = 86400
 ) -> Response:
+    if etag_matches(request, etag):
+        return send_not_modified(etag, cache_seconds, swr_seconds)
     return Response(
         content=svg_text,
         headers={
             "Content-Disposition": f"inline; filename={file_name}",
-            "Last-Modified": formatdate(usegmt=True), # current time gmt
+            "ETag": etag,
             "Cache-Control": f"max-age={cache_seconds // 2}, s-maxage={cache_seconds}, stale-while-revalidate={swr_seconds}"
         },
         media_type="image/svg+xml"
@@ -59,3 +91,27 @@ def k_formatter(value: int) -> str:
     if value > 999:
         return f"{round(value / 1000, 1)}к"
     return str(value)
+
+
+def parse_card_options(
+    query_params: Mapping[str, str],
+    parsers: Dict[str, Callable[[str], Any]]
+) -> Dict[str, Any]:
+    return {
+        name: parser(query_params.get(name, ""))
+        for name, parser in parsers.items()
+    }
+
+
+def card_cache_key(
+    route: str,
+    card_id: Union[str, int],
+    options: Dict[str, Any],
+    theme: Optional[str]
+) -> str:
+    normalized_options = "&".join([
+        f"{name}={value}"
+        for name, value in sorted(options.items())
+        if value is not None
+    ])
+    return f"{route}:{card_id}:{normalized_options}:{theme or ''}"
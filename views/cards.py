@@ -1,40 +1,96 @@
 from starlette.requests import Request
 from starlette.responses import Response
 from starlette.exceptions import HTTPException
-from aiohttp import ClientSession, ClientResponseError
+from aiohttp import ClientResponseError
 from shikithon import ShikimoriAPI
 from shikithon.exceptions import ShikimoriAPIResponseError
 from jinja2 import Environment
 from starlette_context import context
 
-import asyncio
 from datetime import datetime, timedelta
-from base64 import b64encode
-from typing import Tuple, get_args
+from typing import Optional, get_args
 
-from src.fetchers.user_fetcher import fetch_user_card
-from src.fetchers.collection_fetcher import fetch_collection_card
-from src.database import get_db_session, BingoCard
+from src.fetchers.user_fetcher import get_user_card
+from src.fetchers.collection_fetcher import get_collection_card
+from src.fetchers.poster_fetcher import get_posters
+from src.database import get_db_session, pack_bingo_stats
 from src.bingo.__main__ import (
     generate_bingo_card,
     db_get_bingo_card,
+    db_create_bingo_card,
+    db_update_bingo_card,
+    fetch_user_history,
     count_completed_tasks
 )
-from src.bingo.checks import BINGO_TASKS, get_product_type
+from src.bingo.refresher import (
+    BINGO_STALE_SECONDS,
+    is_stale,
+    refresh_bingo_card,
+    request_refresh
+)
+from src.bingo.checks import BINGO_TASKS
 from src.bingo.type_hints import ProductType
 from src.utils import (
+    CACHE_SECONDS,
+    etag_matches,
+    send_not_modified,
     send_svg_file,
-    calculate_ring_progress,
     k_formatter,
     parse_integer,
     parse_boolean,
-    parse_hex_color
+    parse_hex_color,
+    parse_card_options,
+    card_cache_key
 )
+from src.cache import CARD_STALE_CACHE_SECONDS, svg_cache, bingo_svg_cache
+from src.templates import card_etag
 from src.text_wrapper import measure_text, wrap_text_multiline
 from src.themes import themes
 from src.icons import icons
 
 
+COLLECTION_CARD_OPTIONS = {
+    "bg_color": parse_hex_color,
+    "border_color": parse_hex_color,
+    "border_radius": parse_integer,
+    "title_color": parse_hex_color,
+    "text_color": parse_hex_color,
+    "icon_color": parse_hex_color
+}
+USER_CARD_OPTIONS = {
+    **COLLECTION_CARD_OPTIONS,
+    "bar_color": parse_hex_color,
+    "bar_back_color": parse_hex_color,
+    "bar_round": parse_boolean,
+    "show_icons": parse_boolean,
+    "animated": parse_boolean
+}
+BINGO_CARD_OPTIONS = {
+    "bg_color": parse_hex_color,
+    "border_color": parse_hex_color,
+    "border_radius": parse_integer,
+    "title_color": parse_hex_color,
+    "text_color": parse_hex_color
+}
+
+
+# Task descriptions are static, so they are wrapped once at startup
+BINGO_TASKS_DESCRIPTIONS = [
+    wrap_text_multiline(
+        text=task.description,
+        width=150,
+        font_size=20,
+        max_lines=7
+    )
+    for task in BINGO_TASKS
+]
+
+
+def parse_theme(request: Request) -> Optional[str]:
+    theme = request.query_params.get("theme", "default")
+    return theme if theme in themes else None
+
+
 async def user_card(request: Request) -> Response:
     user_id: str = request.path_params["user_id"]
     try:
@@ -44,9 +100,24 @@ async def user_card(request: Request) -> Response:
     else:
         if user_id <= 0:
             raise HTTPException(404)
-    
+
+    options = parse_card_options(request.query_params, USER_CARD_OPTIONS)
+    theme = parse_theme(request)
+    cache_key = card_cache_key("user", user_id, options, theme)
+    file_name = f"user_card_{user_id}.svg"
+    cached = await svg_cache.get(cache_key)
+    if cached is not None:
+        etag, svg_text, cache_seconds = cached
+        return send_svg_file(
+            request,
+            svg_text=svg_text,
+            file_name=file_name,
+            etag=etag,
+            cache_seconds=cache_seconds
+        )
+
     try:
-        card = await fetch_user_card(
+        card, stale = await get_user_card(
             client=context["aiohttp"],
             api=context["shikimori"],
             user_id=user_id
@@ -54,6 +125,11 @@ async def user_card(request: Request) -> Response:
     except ShikimoriAPIResponseError:
         raise HTTPException(404)
 
+    cache_seconds = CARD_STALE_CACHE_SECONDS if stale else CACHE_SECONDS
+    etag = card_etag(cache_key, card)
+    if etag_matches(request, etag):
+        return send_not_modified(etag, cache_seconds)
+
     card_icons = icons["shikimori"]
     stats = [
         {"icon": card_icons.anime, "label": "Просмотрено аниме", "value": k_formatter(card.info.anime_count)},
@@ -64,10 +140,7 @@ async def user_card(request: Request) -> Response:
         {"icon": card_icons.comment, "label": "Написано комментариев", "value": k_formatter(card.info.comments_count)}
     ]
     jinja_env: Environment = context["jinja"]
-    tmpl = jinja_env.get_template(
-        name="user_card.svg",
-        globals={"calculateRingProgress": calculate_ring_progress}
-    )
+    tmpl = jinja_env.get_template("user_card.svg")
     svg_text = tmpl.render(
         height=226,
         width=480,
@@ -77,25 +150,21 @@ async def user_card(request: Request) -> Response:
         rank=card.rank,
         score=card.score,
         stats=stats,
-        options={
-            "bg_color": parse_hex_color(request.query_params.get("bg_color", "")),
-            "border_color": parse_hex_color(request.query_params.get("border_color", "")),
-            "border_radius": parse_integer(request.query_params.get("border_radius", "")),
-            "title_color": parse_hex_color(request.query_params.get("title_color", "")),
-            "text_color": parse_hex_color(request.query_params.get("text_color", "")),
-            "icon_color": parse_hex_color(request.query_params.get("icon_color", "")),
-            "bar_color": parse_hex_color(request.query_params.get("bar_color", "")),
-            "bar_back_color": parse_hex_color(request.query_params.get("bar_back_color", "")),
-            "bar_round": parse_boolean(request.query_params.get("bar_round", "")),
-            "show_icons": parse_boolean(request.query_params.get("show_icons", "")),
-            "animated": parse_boolean(request.query_params.get("animated", ""))
-        },
-        theme=themes.get(request.query_params.get("theme", "default"))
+        options=options,
+        theme=themes.get(theme)
+    ).encode()
+    await svg_cache.set(
+        cache_key,
+        (etag, svg_text, cache_seconds),
+        ttl=cache_seconds if stale else None
     )
 
     return send_svg_file(
+        request,
         svg_text=svg_text,
-        file_name=f"user_card_{user_id}.svg"
+        file_name=file_name,
+        etag=etag,
+        cache_seconds=cache_seconds
     )
 
 
@@ -103,14 +172,35 @@ async def collection_card(request: Request) -> Response:
     collection_id: int = request.path_params["collection_id"]
     if collection_id <= 0:
         raise HTTPException(404)
+
+    options = parse_card_options(request.query_params, COLLECTION_CARD_OPTIONS)
+    theme = parse_theme(request)
+    cache_key = card_cache_key("collection", collection_id, options, theme)
+    file_name = f"collection_card_{collection_id}.svg"
+    cached = await svg_cache.get(cache_key)
+    if cached is not None:
+        etag, svg_text, cache_seconds = cached
+        return send_svg_file(
+            request,
+            svg_text=svg_text,
+            file_name=file_name,
+            etag=etag,
+            cache_seconds=cache_seconds
+        )
+
     try:
-        card = await fetch_collection_card(
+        card, stale = await get_collection_card(
             client=context["aiohttp"],
             collection_id=collection_id
         )
     except ClientResponseError:
         raise HTTPException(404)
 
+    cache_seconds = CARD_STALE_CACHE_SECONDS if stale else CACHE_SECONDS
+    etag = card_etag(cache_key, card)
+    if etag_matches(request, etag):
+        return send_not_modified(etag, cache_seconds)
+
     status = "Пополняется"
     status_color = "#44bbff"
     if card.collection_size == 500:
@@ -155,20 +245,21 @@ async def collection_card(request: Request) -> Response:
         status_color=status_color,
         collection_name=collection_name,
         stats=stats,
-        options={
-            "bg_color": parse_hex_color(request.query_params.get("bg_color", "")),
-            "border_color": parse_hex_color(request.query_params.get("border_color", "")),
-            "border_radius": parse_integer(request.query_params.get("border_radius", "")),
-            "title_color": parse_hex_color(request.query_params.get("title_color", "")),
-            "text_color": parse_hex_color(request.query_params.get("text_color", "")),
-            "icon_color": parse_hex_color(request.query_params.get("icon_color", ""))
-        },
-        theme=themes.get(request.query_params.get("theme", "default"))
+        options=options,
+        theme=themes.get(theme)
+    ).encode()
+    await svg_cache.set(
+        cache_key,
+        (etag, svg_text, cache_seconds),
+        ttl=cache_seconds if stale else None
     )
 
     return send_svg_file(
+        request,
         svg_text=svg_text,
-        file_name=f"collection_card_{collection_id}.svg"
+        file_name=file_name,
+        etag=etag,
+        cache_seconds=cache_seconds
     )
 
 
@@ -181,71 +272,73 @@ async def bingo_card(request: Request) -> Response:
     if len(product_types) == 0 or any([t not in get_args(ProductType) for t in product_types]):
         raise HTTPException(400)
 
+    options = parse_card_options(request.query_params, BINGO_CARD_OPTIONS)
+    theme = parse_theme(request)
+    cache_key = card_cache_key(
+        "bingo",
+        f"{user_id}:{','.join(sorted(set(product_types)))}",
+        options,
+        theme
+    )
+    file_name = f"bingo_card_{user_id}.svg"
+    cached = await bingo_svg_cache.get(cache_key)
+    if cached is not None:
+        etag, svg_text, cache_seconds = cached
+        return send_svg_file(
+            request,
+            svg_text=svg_text,
+            file_name=file_name,
+            etag=etag,
+            cache_seconds=cache_seconds
+        )
+
+    refresh_requested = False
     async with get_db_session() as db:
         bingo_card = await db_get_bingo_card(db, user_id)
         api: ShikimoriAPI = context["shikimori"]
         if bingo_card is None:
-            history = await api.users.history(
-                user_id=user_id,
-                page=1,
-                limit=1
-            )
+            history = await fetch_user_history(api, user_id, page=1, limit=1)
             if len(history) == 0:
                 raise HTTPException(400)
 
-            bingo_card = BingoCard(
-                user_id=user_id,
-                last_history_id=history[0].id,
-                stats=generate_bingo_card(16, product_types)
-            )
-
-            db.add(bingo_card)
+            bingo_card = await db_create_bingo_card(db, {
+                "user_id": user_id,
+                "last_history_id": history[0].id,
+                "stats_data": pack_bingo_stats(generate_bingo_card(16, product_types)),
+                "history_scanned": 0,
+                "scanned_at": datetime.now()
+            })
             await db.commit()
         else:
             if count_completed_tasks(bingo_card.stats) < len(bingo_card.stats):
-                history = await api.users.history(
-                    user_id=user_id,
-                    page=1,
-                    limit=100
-                )
-                if len(history) != 0:
-                    # [! Change this code only if you have checked it thoroughly
-                    bingo_stats: dict = bingo_card.stats.copy()
-                    for h in history:
-                        if h.id == bingo_card.last_history_id:
-                            break
-                        for k, v in bingo_stats.items():
-                            if v is not None:
-                                continue
-                            task_check = BINGO_TASKS[int(k) - 1]
-                            if not await task_check.check(api, h):
-                                continue
-                            bingo_stats[k] = f"{get_product_type(h.target)}-{h.target.id}"
-                    bingo_card.stats = bingo_stats
-                    # !]
-                    bingo_card.last_history_id = history[0].id
-                    await db.commit()
+                if is_stale(bingo_card):
+                    # The stored stats are rendered while the card refreshes
+                    refresh_requested = await request_refresh(db, user_id)
+                    if not refresh_requested:
+                        await refresh_bingo_card(db, api, bingo_card)
+                        await db.commit()
             else:
-                bingo_card.stats = generate_bingo_card(16, product_types)
+                await db_update_bingo_card(db, bingo_card, {
+                    "stats_data": pack_bingo_stats(generate_bingo_card(16, product_types))
+                })
                 await db.commit()
 
-        async def _get_poster(stat: str, url: str) -> Tuple[str, str]:
-            client: ClientSession = context["aiohttp"]
-            async with client.get(url) as resp:
-                return stat, "data:image/jpg;base64," + b64encode(await resp.read()).decode("ascii")
-            
-        posters = dict(await asyncio.gather(*[
-            _get_poster(
-                stat=stat,
-                url="https://shikimori.one/" + (
-                    "system/animes/preview/{}.jpg"
-                    if stat.startswith("anime") else
-                    "system/mangas/preview/{}.jpg"
-                ).format(stat.split("-")[1])
-            )
-            for stat in bingo_card.stats.values()
-            if stat is not None
-        ]))
+        bingo_stats = bingo_card.stats
+        # Until the refreshed stats can be rendered
+        cache_seconds = BINGO_STALE_SECONDS if refresh_requested else CACHE_SECONDS
+        etag = card_etag(cache_key, bingo_stats)
+        if etag_matches(request, etag):
+            return send_not_modified(etag, cache_seconds)
+
+        posters = await get_posters(
+            db=db,
+            client=context["aiohttp"],
+            products=[
+                stat
+                for stat in bingo_stats.values()
+                if stat is not None
+            ]
+        )
 
         jinja_env: Environment = context["jinja"]
         tmpl = jinja_env.get_template("bingo_card.svg")
@@ -256,30 +349,24 @@ async def bingo_card(request: Request) -> Response:
             cell_height=200,
             cell_width=150,
             cell_gap=20,
-            bingo_stats=bingo_card.stats,
+            bingo_stats=bingo_stats,
             posters=posters,
             stats_descr={
-                n: wrap_text_multiline(
-                    text=BINGO_TASKS[int(n) - 1].description,
-                    width=150,
-                    font_size=20,
-                    max_lines=7
-                )
-                for n in bingo_card.stats.keys()
+                n: BINGO_TASKS_DESCRIPTIONS[int(n) - 1]
+                for n in bingo_stats.keys()
             },
-            options={
-                "bg_color": parse_hex_color(request.query_params.get("bg_color", "")),
-                "border_color": parse_hex_color(request.query_params.get("border_color", "")),
-                "border_radius": parse_integer(request.query_params.get("border_radius", "")),
-                "title_color": parse_hex_color(request.query_params.get("title_color", "")),
-                "text_color": parse_hex_color(request.query_params.get("text_color", ""))
-            },
-            theme=themes.get(request.query_params.get("theme", "default"))
-        )
+            options=options,
+            theme=themes.get(theme)
+        ).encode()
 
         db.expire(bingo_card)
 
+    await bingo_svg_cache.set(cache_key, (etag, svg_text, cache_seconds), ttl=cache_seconds)
+
     return send_svg_file(
+        request,
         svg_text=svg_text,
-        file_name=f"bingo_card_{user_id}.svg"
+        file_name=file_name,
+        etag=etag,
+        cache_seconds=cache_seconds
     )
@@ -1,20 +1,43 @@
 from starlette.requests import Request
 from starlette.exceptions import HTTPException
-from starlette.responses import Response, PlainTextResponse, RedirectResponse
+from starlette.responses import (
+    Response,
+    PlainTextResponse,
+    RedirectResponse,
+    JSONResponse
+)
 
 import os
 
-from src.database import migrate
+from src.database import migrate, get_pool_stats
+from src.cache import get_cache_stats
+from src.bingo.base_check import get_check_stats
+from src.fetchers.conditional import get_revalidation_stats
 
 
 async def index(_: Request) -> Response:
     return RedirectResponse("https://github.com/ren3104/shikimori-cards")
 
 
-async def migrate_route(request: Request) -> Response:
+def check_secret(request: Request) -> None:
     secret = request.query_params.get("secret")
     if secret is None or secret != os.environ.get("SHIKIMORI_CARDS_SECRET", "4ever"):
         raise HTTPException(403)
-    
+
+
+async def migrate_route(request: Request) -> Response:
+    check_secret(request)
+
     await migrate()
     return PlainTextResponse("ok")
+
+
+async def stats_route(request: Request) -> Response:
+    check_secret(request)
+
+    return JSONResponse({
+        "caches": get_cache_stats(),
+        "checks": get_check_stats(),
+        "database": get_pool_stats(),
+        "revalidation": get_revalidation_stats()
+    })